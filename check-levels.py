@@ -0,0 +1,173 @@
+#! /usr/bin/env python
+'''Check and precompile level maps.
+
+Every .map file given on the command line (directories are searched for
+them) is parsed the same way the game does it and checked for:
+
+- sand and beach tiles with no sprite for their neighbours, which show up
+  as water in the game
+- missing player start, which leaves the player at the top left corner
+- hearts and medals the player cannot sail to from the start
+- cannons with no water three tiles away or whose firing lanes never cross
+  the player's way
+
+Maps without problems are precompiled into a .mapc file next to them, which
+the game loads instead of parsing the map again. Maps are checked on a pool
+of worker processes. Positions are reported as map row and column; the game
+mirrors every map, problems in the mirrored half are reported at the tile
+they come from.
+'''
+
+import os
+import sys
+import time
+import argparse
+import concurrent.futures
+
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+import run_game
+
+
+def source(level, x, y):
+    # map row and column (from 1) of level tile, level is the map followed
+    # by the map turned upside down
+    width = level.width // 2
+    if x >= width:
+        (x, y) = (level.width - 1 - x, level.height - 1 - y)
+    return (y + 1, x + 1)
+
+
+def reachable(level, x, y):
+    '''Return bytearray marking tiles the player can sail to from (x, y).
+    '''
+    sand = bytearray(level.width * level.height)
+    for tile_y in range(0, level.height):
+        for tile_x in range(0, level.width):
+            if level.get_tile(tile_x, tile_y)['name'] == 'sand':
+                sand[tile_y * level.width + tile_x] = 1
+
+    def blocked(x, y):
+        if not (0 <= x < level.width and 0 <= y < level.height):
+            return False
+        return sand[y * level.width + x]
+
+    # same rule as Player movement: next two tiles must not be sand
+    seen = bytearray(level.width * level.height)
+    seen[y * level.width + x] = 1
+    stack = [(x, y)]
+    while stack:
+        (x, y) = stack.pop()
+        for (dx, dy) in run_game.DIRECTIONS.values():
+            (next_x, next_y) = (x + dx, y + dy)
+            if not (0 <= next_x < level.width and 0 <= next_y < level.height):
+                continue
+            if seen[next_y * level.width + next_x]:
+                continue
+            if blocked(next_x, next_y) or blocked(next_x + dx, next_y + dy):
+                continue
+            seen[next_y * level.width + next_x] = 1
+            stack.append((next_x, next_y))
+    return seen
+
+
+def check(filename, compile=True):
+    '''Check one map, return (filename, problems, timings).
+
+    Runs in worker processes.
+    '''
+    timings = []
+    start = time.perf_counter()
+    level = run_game.Level(None)
+    try:
+        with open(filename, 'rb') as f:
+            content = f.read()
+        level.parse(content)
+    except Exception as e:
+        return (filename, ['cannot be parsed: %s: %s' % (type(e).__name__, e)], timings)
+    timings.append(('parse', time.perf_counter() - start))
+
+    start = time.perf_counter()
+    problems = set()
+    for (x, y, name, hashed) in level.missing:
+        if x >= level.width // 2:
+            # neighbours of mirrored tile are swapped left to right and
+            # top to bottom
+            hashed = hashed[1] + hashed[0] + hashed[3] + hashed[2]
+        problems.add((source(level, x, y), 'no sprite %s-%s, shown as water' % (name, hashed)))
+
+    players = [(x, y) for (name, x, y, position) in level.spawns if name == 'player']
+    if players:
+        seen = reachable(level, *players[0])
+    else:
+        problems.add(((0, 0), 'no player start (★)'))
+        seen = None
+
+    # cannons which can shoot at any tile the player can get to
+    active = set()
+    if seen is not None:
+        for ((x, y), cannons) in level.lanes.items():
+            if 0 <= x < level.width and 0 <= y < level.height and seen[y * level.width + x]:
+                active.update((cannon_x, cannon_y) for (cannon_x, cannon_y, direction) in cannons)
+
+    for (name, x, y, position) in level.spawns:
+        if name in ('heart', 'medal') and seen is not None and not seen[y * level.width + x]:
+            problems.add((source(level, x, y), '%s cannot be reached' % name))
+        elif name == 'cannon':
+            water = [direction for (direction, (dx, dy)) in run_game.DIRECTIONS.items()
+                     if level.get_tile(x + dx * 3, y + dy * 3)['name'] == 'water']
+            if not water:
+                problems.add((source(level, x, y), 'cannon has no water three tiles away'))
+            elif seen is not None and (x, y) not in active:
+                problems.add((source(level, x, y), 'cannon can never shoot at the player'))
+    timings.append(('check', time.perf_counter() - start))
+
+    if compile and not problems:
+        start = time.perf_counter()
+        level.save_compiled(filename + 'c', level.digest(content))
+        timings.append(('compile', time.perf_counter() - start))
+
+    problems = ['row %d, column %d: %s' % (row, column, text) if row else text
+                for ((row, column), text) in sorted(problems)]
+    return (filename, problems, timings)
+
+
+def find_maps(paths):
+    filenames = []
+    for path in paths:
+        if not os.path.isdir(path):
+            filenames.append(path)
+            continue
+        for dirpath, dirnames, names in os.walk(path):
+            dirnames[:] = sorted(name for name in dirnames if not name.startswith('.'))
+            filenames.extend(os.path.join(dirpath, name) for name in sorted(names)
+                             if name.endswith('.map'))
+    return filenames
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check and precompile Pirate Flow levels')
+    parser.add_argument('paths', nargs='*', default=['data/levels'],
+                        help='map files or directories with them (default: data/levels)')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='number of worker processes (default: one per CPU)')
+    parser.add_argument('--no-compile', action='store_true',
+                        help='only check maps, do not write .mapc files')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    filenames = find_maps(args.paths)
+    failed = 0
+    with concurrent.futures.ProcessPoolExecutor(args.jobs) as pool:
+        compile = [not args.no_compile] * len(filenames)
+        for (filename, problems, timings) in pool.map(check, filenames, compile, chunksize=4):
+            timing = ', '.join('%s %.1f ms' % (phase, seconds * 1000) for (phase, seconds) in timings)
+            if problems:
+                failed += 1
+                print('%s: %d problems%s' % (filename, len(problems), timing and ' (%s)' % timing))
+                for problem in problems:
+                    print('  ' + problem)
+            else:
+                print('%s: ok (%s)' % (filename, timing))
+
+    print('Checked %d maps in %.1f s, %d with problems' % (len(filenames), time.perf_counter() - start, failed))
+    sys.exit(1 if failed else 0)
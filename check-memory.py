@@ -0,0 +1,40 @@
+#! /usr/bin/env python
+'''Check that gameplay stays within the memory budget.
+
+The game is started without a window or sound, plays by itself for a
+while and reports how much memory Python allocates per frame (see
+--trace-memory of run_game.py). The check fails when the 95th percentile
+of memory allocated per frame is above MEMORY_BUDGET of run_game.py, so
+changes which make frames allocate more (and the garbage collector pause
+more often) are caught before they are released. The budget is set well
+above what the game allocates now (see run_game.py), so it does not fail
+on differences between runs.
+'''
+
+import os
+import sys
+import argparse
+import subprocess
+
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+import run_game
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check Pirate Flow memory allocated per frame')
+    parser.add_argument('--frames', type=int, default=750,
+                        help='frames to play, first 250 are not measured (default: %(default)s)')
+    parser.add_argument('--budget', type=float, default=run_game.MEMORY_BUDGET,
+                        help='kB 95%% of frames may allocate at most (default: %(default)s)')
+    args = parser.parse_args()
+
+    # game is run on its own so nothing imported here is measured
+    env = dict(os.environ, SDL_VIDEODRIVER='dummy', SDL_AUDIODRIVER='dummy')
+    command = [sys.executable, 'run_game.py', '--autoplay', '--frames', str(args.frames),
+               '--memory-budget', str(args.budget)]
+    status = subprocess.call(command, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if status:
+        print('Memory check failed')
+    else:
+        print('Memory check passed, budget is %.1f kB for 95%% of frames' % args.budget)
+    sys.exit(status)
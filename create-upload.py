@@ -11,53 +11,199 @@ The script ignores:
 - any dotfiles (files starting with ".")
 - .pyc and .pyo files
 
+Files which are already compressed (images, sounds) are stored as they are,
+everything else is compressed on a pool of worker processes. Archives are
+reproducible: entries are sorted and get a fixed timestamp, so building
+the same files twice gives an identical ZIP. When nothing has changed since
+the previous build the archive is not written again.
 '''
 
-import sys
 import os
-import zipfile
+import sys
+import zlib
+import time
+import struct
+import hashlib
+import concurrent.futures
+
+# files with these extensions gain nothing from compression
+STORED = ('.png', '.jpg', '.jpeg', '.gif', '.ogg', '.mp3', '.zip', '.gz')
+
+# ZIP needs dates after 1980, SOURCE_DATE_EPOCH overrides it if set
+EPOCH = (1980, 1, 1, 0, 0, 0)
 
-if len(sys.argv) != 2:
-    print '''Usage: python %s <release filename-version>
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
 
-eg. python %s my_cool_game-1.0'''%(sys.argv[0], sys.argv[0])
+
+def usage():
+    print('''Usage: python %s [-j jobs] <release filename-version>
+
+eg. python %s my_cool_game-1.0''' % (sys.argv[0], sys.argv[0]))
     sys.exit()
 
-base = sys.argv[1]
-zipname = base + '.zip'
-
-try:
-    package = zipfile.ZipFile(zipname, 'w', zipfile.ZIP_DEFLATED)
-except RuntimeError:
-    package = zipfile.ZipFile(zipname, 'w')
-
-# core files
-for name in 'README.md run_game.py requirements.txt'.split():
-    package.write(name, os.path.join(base, name))
-package.write('run_game.py', os.path.join(base, 'run_game.pyw'))
-
-# utility for adding subdirectories
-def add_files(generator):
-    for dirpath, dirnames, filenames in generator:
-        for name in list(dirnames):
-            if name == 'CVS' or name.startswith('.'):
-                dirnames.remove(name)
-
-        for name in filenames:
-            if name.startswith('.'): continue
-            suffix = os.path.splitext(name)[1]
-            if suffix in ('.pyc', '.pyo'): continue
-            if name[0] == '.': continue
-            filename = os.path.join(dirpath, name)
-            package.write(filename, os.path.join(base, filename))
-
-# add the lib and data directories
-add_files(os.walk('gamelib'))
-add_files(os.walk('data'))
-
-# calculate MD5
-import hashlib
-d = hashlib.md5()
-d.update(file(zipname, 'rb').read())
-print 'Created', zipname
-print 'MD5 hash:', d.hexdigest()
+
+def collect(base):
+    '''Return sorted list of (archive name, file name) to package.
+    '''
+    files = []
+
+    # core files
+    for name in 'README.md run_game.py requirements.txt'.split():
+        files.append((os.path.join(base, name), name))
+    files.append((os.path.join(base, 'run_game.pyw'), 'run_game.py'))
+
+    # add the lib and data directories
+    for top in ('gamelib', 'data'):
+        for dirpath, dirnames, filenames in os.walk(top):
+            for name in list(dirnames):
+                if name == 'CVS' or name == '__pycache__' or name.startswith('.'):
+                    dirnames.remove(name)
+
+            for name in filenames:
+                if name.startswith('.'): continue
+                suffix = os.path.splitext(name)[1]
+                if suffix in ('.pyc', '.pyo'): continue
+                filename = os.path.join(dirpath, name)
+                files.append((os.path.join(base, filename), filename))
+
+    # use the same separators and ordering on every platform
+    files = [(arcname.replace(os.sep, '/'), filename) for arcname, filename in files]
+    return sorted(files)
+
+
+def compress(filename):
+    '''Read a file and return (method, crc, size, data) ready for the ZIP.
+
+    Runs in worker processes.
+    '''
+    with open(filename, 'rb') as f:
+        content = f.read()
+    crc = zlib.crc32(content) & 0xffffffff
+
+    if os.path.splitext(filename)[1].lower() in STORED:
+        return (ZIP_STORED, crc, len(content), content)
+
+    # raw deflate stream, same as zipfile.ZIP_DEFLATED writes
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    data = compressor.compress(content) + compressor.flush()
+    return (ZIP_DEFLATED, crc, len(content), data)
+
+
+class HashingWriter(object):
+    '''File wrapper which hashes everything written through it.
+    '''
+    def __init__(self, f):
+        self.f = f
+        self.md5 = hashlib.md5()
+        self.offset = 0
+
+    def write(self, data):
+        self.f.write(data)
+        self.md5.update(data)
+        self.offset += len(data)
+
+
+class ZipWriter(object):
+    '''Minimal streaming ZIP writer for already compressed entries.
+
+    Each entry is written once, front to back, so the archive can be hashed
+    while it is being written.
+    '''
+    def __init__(self, out, date_time=EPOCH):
+        self.out = out
+        self.entries = []
+        (year, month, day, hour, minute, second) = date_time[:6]
+        self.dos_time = hour << 11 | minute << 5 | second // 2
+        self.dos_date = (year - 1980) << 9 | month << 5 | day
+
+    def add(self, arcname, mode, method, crc, size, data):
+        name = arcname.encode('utf-8')
+        offset = self.out.offset
+        self.out.write(struct.pack('<IHHHHHIIIHH', 0x04034b50, 20, 0x800, method,
+                                   self.dos_time, self.dos_date, crc, len(data), size,
+                                   len(name), 0))
+        self.out.write(name)
+        self.out.write(data)
+        self.entries.append((name, mode, method, crc, len(data), size, offset))
+
+    def close(self):
+        start = self.out.offset
+        for (name, mode, method, crc, compressed, size, offset) in self.entries:
+            self.out.write(struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, 3 << 8 | 20, 20,
+                                       0x800, method, self.dos_time, self.dos_date, crc,
+                                       compressed, size, len(name), 0, 0, 0, 0,
+                                       mode << 16, offset))
+            self.out.write(name)
+        end = self.out.offset
+        self.out.write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, len(self.entries),
+                                   len(self.entries), end - start, start, 0))
+
+
+def file_mode(filename):
+    # keep executable bit, drop everything else which depends on the machine
+    if os.stat(filename).st_mode & 0o100:
+        return 0o100755
+    return 0o100644
+
+
+def inputs_digest(files):
+    '''Hash of everything that ends up in the archive.
+    '''
+    digest = hashlib.sha1()
+    for arcname, filename in files:
+        digest.update(arcname.encode('utf-8') + b'\0')
+        digest.update(struct.pack('<I', file_mode(filename)))
+        with open(filename, 'rb') as f:
+            digest.update(hashlib.sha1(f.read()).digest())
+    return digest.hexdigest()
+
+
+def package(base, jobs=None):
+    zipname = base + '.zip'
+    stampname = zipname + '.stamp'
+    files = collect(base)
+
+    date_time = EPOCH
+    if 'SOURCE_DATE_EPOCH' in os.environ:
+        date_time = max(EPOCH, time.gmtime(int(os.environ['SOURCE_DATE_EPOCH']))[:6])
+
+    # skip the build when the same files were packaged last time
+    digest = inputs_digest(files) + ' %04d%02d%02d%02d%02d%02d' % date_time
+    if os.path.isfile(zipname) and os.path.isfile(stampname):
+        with open(stampname) as f:
+            (previous, md5) = f.read().rsplit('\n', 1)
+        if previous == digest:
+            print('Unchanged', zipname)
+            print('MD5 hash:', md5)
+            return md5
+
+    with open(zipname + '.tmp', 'wb') as f:
+        out = HashingWriter(f)
+        archive = ZipWriter(out, date_time)
+        with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+            results = pool.map(compress, [filename for arcname, filename in files], chunksize=4)
+            for (arcname, filename), result in zip(files, results):
+                archive.add(arcname, file_mode(filename), *result)
+        archive.close()
+    os.replace(zipname + '.tmp', zipname)
+
+    md5 = out.md5.hexdigest()
+    with open(stampname, 'w') as f:
+        f.write(digest + '\n' + md5)
+
+    print('Created', zipname)
+    print('MD5 hash:', md5)
+    return md5
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    jobs = None
+    if len(args) == 3 and args[0] == '-j':
+        jobs = int(args[1])
+        args = args[2:]
+    if len(args) != 1:
+        usage()
+
+    package(args[0], jobs)
@@ -0,0 +1,134 @@
+'''Texture atlas of game sprites.
+
+Every sprite the game draws is scaled to the size it is drawn at and packed
+into one image, data/atlas.png, with its place recorded in data/atlas.json.
+The game then decodes a single image instead of dozens of small files and
+hands out subsurfaces of it.
+
+Build the atlas with "python -m gamelib.atlas" (before building the
+resource pack) and build it again after changing any sprite. Sprites and
+sizes which are not in the atlas are still loaded from their own files.
+'''
+
+import os
+import json
+import pygame
+
+from gamelib import data
+
+image_name = 'atlas.png'
+index_name = 'atlas.json'
+
+# atlas is this wide, sprites are packed into rows (shelves) of it
+atlas_width = 512
+
+# terrain tiles are drawn at tile size
+tile_size = (32, 32)
+terrain = ('beach-', 'sand-', 'grass', 'sandbg', 'water')
+
+# sizes other sprites are drawn at, None keeps the size of the file
+sizes = {
+    'achievements': [None],
+    'bullet': [None, (80, 80)],
+    'cannon': [None],
+    'explosion1': [(16, 16)],
+    'explosion2': [(32, 32), (64, 64), (96, 96)],
+    'explosion3': [(8, 8), (16, 16), (32, 32), (64, 64), (96, 96)],
+    'heart': [(32, 32)],
+    'medal': [(32, 32), (64, 64)],
+    'panel-body': [None],
+    'panel-end': [None],
+    'panel-start': [None],
+    'player': [(64, 64)],
+    'ship': [(80, 80)],
+    'shoot': [(64, 64)],
+    'star': [None],
+    'world': [(64, 64)],
+}
+
+
+def sprites():
+    '''Return sorted list of (name, size) to pack.
+    '''
+    wanted = []
+    for filename in sorted(os.listdir(data.filepath('sprites'))):
+        if not filename.endswith('.png'):
+            continue
+        name = filename[:-4]
+        if name.startswith(terrain):
+            wanted.append((name, tile_size))
+        for size in sizes.get(name, ()):
+            wanted.append((name, size))
+    return wanted
+
+
+def pack(sizes, width=atlas_width):
+    '''Place rectangles of given (width, height) into shelves, tallest first.
+
+    Returns list of (x, y) in the same order as sizes and total height.
+    '''
+    order = sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0]))
+    places = [None] * len(sizes)
+    (x, y, shelf) = (0, 0, 0)
+    for i in order:
+        (w, h) = sizes[i]
+        if x + w > width:
+            (x, y, shelf) = (0, y + shelf, 0)
+        places[i] = (x, y)
+        x += w
+        shelf = max(shelf, h)
+    return (places, y + shelf)
+
+
+def build():
+    '''Scale and pack all sprites, write the atlas image and index.
+    '''
+    # sprites are converted exactly like the game does it, so the atlas
+    # holds the same pixels as separately loaded sprites
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.display.init()
+    pygame.display.set_mode((1, 1))
+
+    wanted = sprites()
+    images = []
+    for (name, size) in wanted:
+        image = pygame.image.load(data.filepath('sprites/' + name + '.png')).convert_alpha()
+        if size is not None:
+            image = pygame.transform.scale(image, size)
+        images.append(image)
+
+    (places, height) = pack([image.get_size() for image in images])
+    atlas = pygame.Surface((atlas_width, height), pygame.SRCALPHA, 32).convert_alpha()
+    atlas.fill((0, 0, 0, 0))
+    index = []
+    for ((name, size), image, (x, y)) in zip(wanted, images, places):
+        # max blend into transparent black copies pixels with their alpha
+        atlas.blit(image, (x, y), special_flags=pygame.BLEND_RGBA_MAX)
+        index.append([name, size and list(size), x, y, image.get_width(), image.get_height()])
+
+    pygame.image.save(atlas, data.filepath(image_name))
+    with open(data.filepath(index_name), 'w') as f:
+        json.dump({'size': [atlas_width, height], 'sprites': index}, f, separators=(',', ':'))
+    return (len(index), (atlas_width, height))
+
+
+def load():
+    '''Return decoded atlas image and {(name, size): rect} of sprites in it.
+
+    Returns None if no atlas has been built. Safe to call from the loader
+    thread, the image still has to be converted for the display.
+    '''
+    if not (data.exists(image_name) and data.exists(index_name)):
+        return None
+    index = json.loads(bytes(data.read(index_name)).decode('utf-8'))
+    image = pygame.image.load(data.load(image_name), image_name)
+
+    rects = {}
+    for (name, size, x, y, width, height) in index['sprites']:
+        rects[(name, size and tuple(size))] = (x, y, width, height)
+    return (image, rects)
+
+
+if __name__ == '__main__':
+    (count, size) = build()
+    print('Packed %d sprites into %s (%dx%d)' % (count, data.filepath(image_name), size[0], size[1]))
@@ -2,14 +2,35 @@
 
 Loads data files from the "data" directory shipped with a game.
 
-Enhancing this to handle caching etc. is left as an exercise for the reader.
+When a resource pack has been built (run "python -m gamelib.data") files are
+served straight from the memory-mapped pack, so loading a sprite does not
+open a file at all. Without a pack the loose files are read and the most
+recently used ones are kept in a small in-process cache. Loose files
+changed after the pack was built are read instead of their packed copies
+(with a warning that the pack is out of date).
 '''
 
+import io
 import os
+import sys
+import json
+import mmap
+import struct
+import threading
+import collections
 
 data_py = os.path.abspath(os.path.dirname(__file__))
 data_dir = os.path.normpath(os.path.join(data_py, '..', 'data'))
 
+# pack is built from everything in data directory except these folders
+pack_path = os.path.join(data_dir, 'resources.pack')
+pack_skip = ('screenshots',)
+pack_magic = b'PFPACK1\n'
+
+# memory budget of the loose file cache, in megabytes
+cache_budget = int(os.environ.get('PIRATE_FLOW_CACHE_MB', 8))
+
+
 def filepath(filename):
     '''Determine the path to a file in the data directory.
     '''
@@ -18,7 +39,244 @@ def filepath(filename):
 def load(filename, mode='rb'):
     '''Open a file in the data directory.
 
-    "mode" is passed as the second arg to open().
+    "mode" is passed as the second arg to open(). Files opened in binary
+    mode are returned as read-only file objects served from the resource
+    pack or the cache.
+    '''
+    if 'b' not in mode:
+        return open(os.path.join(data_dir, filename), mode)
+    return ResourceFile(read(filename), filename)
+
+def read(filename):
+    '''Return contents of a file in the data directory.
+
+    Packed files are returned as a memoryview into the pack, loose files
+    as bytes.
+    '''
+    pack = get_pack()
+    if pack is not None and filename in pack:
+        return pack.read(filename)
+
+    content = cache.get(filename)
+    if content is None:
+        with open(os.path.join(data_dir, filename), 'rb') as f:
+            content = f.read()
+        cache.put(filename, content, len(content))
+    return content
+
+def exists(filename):
+    '''Check if a file is shipped in the data directory.
     '''
-    return open(os.path.join(data_dir, filename), mode)
+    pack = get_pack()
+    if pack is not None and filename in pack:
+        return True
+    with lock:
+        if filename not in found:
+            found[filename] = os.path.isfile(os.path.join(data_dir, filename))
+        return found[filename]
+
+def listdir(dirname):
+    '''Return sorted names of files in a directory of the data directory.
+
+    Files in the resource pack and loose files are both listed, so a game
+    shipped with only the pack finds its files too.
+    '''
+    prefix = dirname.rstrip('/') + '/'
+    names = set()
+    pack = get_pack()
+    if pack is not None:
+        for filename in pack.index:
+            if filename.startswith(prefix) and '/' not in filename[len(prefix):]:
+                names.add(filename[len(prefix):])
+    path = os.path.join(data_dir, dirname)
+    if os.path.isdir(path):
+        names.update(name for name in os.listdir(path) if os.path.isfile(os.path.join(path, name)))
+    return sorted(names)
+
+
+class ResourceFile(io.RawIOBase):
+    '''Read-only file object over a memoryview.
+
+    Nothing is copied until data is read from it, so packed files are
+    handed to pygame straight from the memory map.
+    '''
+    def __init__(self, content, name):
+        io.RawIOBase.__init__(self)
+        self.view = memoryview(content)
+        self.name = name
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), len(self.view) - self.pos)
+        if size <= 0:
+            return 0
+        buffer[:size] = self.view[self.pos:self.pos + size]
+        self.pos += size
+        return size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        self.pos = max(0, offset)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+
+class LRUCache(object):
+    '''Keep the most recently used values while their total size fits
+    into the budget (in bytes).
+    '''
+    def __init__(self, budget):
+        self.budget = budget
+        self.size = 0
+        self.items = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.items:
+                return None
+            self.items.move_to_end(key)
+            return self.items[key][0]
+
+    def put(self, key, value, size):
+        if size > self.budget:
+            return
+        with self.lock:
+            if key in self.items:
+                self.size -= self.items.pop(key)[1]
+            self.items[key] = (value, size)
+            self.size += size
+
+            # drop least recently used values until we are back in budget
+            while self.size > self.budget:
+                self.size -= self.items.popitem(last=False)[1][1]
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.size = 0
+
+
+class Pack(object):
+    '''Single file holding all game data, memory-mapped on open.
+
+    Layout is the magic line, 4 byte little endian index size, JSON index
+    mapping file names to (offset, size) and then the file contents. Offsets
+    are relative to the end of the index.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(pack_magic)] != pack_magic:
+            self.close()
+            raise ValueError('%s is not a resource pack' % path)
+
+        start = len(pack_magic) + 4
+        (size,) = struct.unpack_from('<I', self.map, len(pack_magic))
+        self.index = json.loads(self.map[start:start + size].decode('utf-8'))
+        self.base = start + size
+        self.view = memoryview(self.map)
+
+        # packed files whose loose copies changed after the pack was built
+        built = os.path.getmtime(path)
+        self.stale = set(filename for filename in data_files(path)
+                         if filename in self.index and os.path.getmtime(os.path.join(data_dir, filename)) > built)
+
+    def __contains__(self, filename):
+        return filename in self.index and filename not in self.stale
+
+    def read(self, filename):
+        (offset, size) = self.index[filename]
+        return self.view[self.base + offset:self.base + offset + size]
+
+    def close(self):
+        if getattr(self, 'view', None) is not None:
+            self.view.release()
+        self.map.close()
+        self.file.close()
+
+
+def data_files(skip=pack_path):
+    '''Return sorted names of all data files which go into the pack.
+    '''
+    filenames = []
+    for dirpath, dirnames, names in os.walk(data_dir):
+        dirnames[:] = sorted(name for name in dirnames
+                             if not name.startswith('.') and name not in pack_skip)
+        for name in sorted(names):
+            filename = os.path.join(dirpath, name)
+            if name.startswith('.') or filename == os.path.abspath(skip):
+                continue
+            filenames.append(os.path.relpath(filename, data_dir).replace(os.sep, '/'))
+    return filenames
+
+def build_pack(path=pack_path):
+    '''Write all data files into a single resource pack.
+    '''
+    filenames = data_files(path)
+
+    index = {}
+    offset = 0
+    for filename in filenames:
+        size = os.path.getsize(os.path.join(data_dir, filename))
+        index[filename] = (offset, size)
+        offset += size
+    header = json.dumps(index, sort_keys=True).encode('utf-8')
+
+    with open(path, 'wb') as pack:
+        pack.write(pack_magic)
+        pack.write(struct.pack('<I', len(header)))
+        pack.write(header)
+        for filename in filenames:
+            with open(os.path.join(data_dir, filename), 'rb') as f:
+                pack.write(f.read())
+    return filenames
+
+
+def get_pack():
+    '''Return the resource pack, opening it on first use.
+
+    Returns None if no pack has been built.
+    '''
+    global pack, pack_checked
+    if not pack_checked:
+        with lock:
+            if not pack_checked:
+                if os.path.isfile(pack_path):
+                    pack = Pack(pack_path)
+                    if pack.stale:
+                        sys.stderr.write('%d data files changed since %s was built (%s), they are loaded '
+                                         'from the data directory; run "python -m gamelib.data" to build it again\n'
+                                         % (len(pack.stale), pack_path, ', '.join(sorted(pack.stale)[:3])))
+                pack_checked = True
+    return pack
+
+def set_cache_budget(megabytes):
+    '''Change memory budget of the loose file cache.
+    '''
+    cache.budget = int(megabytes * 1024 * 1024)
+    cache.clear()
+
+
+pack = None
+pack_checked = False
+found = {}
+lock = threading.Lock()
+cache = LRUCache(cache_budget * 1024 * 1024)
+
 
+if __name__ == '__main__':
+    filenames = build_pack()
+    print('Packed %d files into %s' % (len(filenames), pack_path))
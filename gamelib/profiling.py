@@ -0,0 +1,371 @@
+'''Timing helpers.
+
+Used to find out where the game spends its time and memory. Nothing here
+depends on pygame so the helpers can be used before any subsystem is
+initialized.
+'''
+
+import gc
+import os
+import sys
+import time
+import threading
+import tracemalloc
+
+
+class StartupTrace(object):
+    '''Collect time spent in each start up phase.
+
+    Phases measured on the main thread are added with mark(), which records
+    the time passed since the previous mark. Work done on other threads is
+    added with add() together with its own measured duration.
+    '''
+    def __init__(self, start=None, enabled=True):
+        if start is None:
+            start = time.perf_counter()
+        self.start = self.last = start
+        self.enabled = enabled
+        self.phases = []
+        self.background = {}
+        self.lock = threading.Lock()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def add(self, phase, seconds):
+        with self.lock:
+            self.background[phase] = self.background.get(phase, 0) + seconds
+
+    def total(self):
+        return self.last - self.start
+
+    def report(self, out=None):
+        if not self.enabled:
+            return
+        out = out or sys.stderr
+        out.write('startup trace:\n')
+        for phase, seconds in self.phases:
+            out.write('  %-16s %8.1f ms\n' % (phase, seconds * 1000))
+        for phase, seconds in sorted(self.background.items()):
+            out.write('  %-16s %8.1f ms (background)\n' % (phase, seconds * 1000))
+        out.write('  %-16s %8.1f ms\n' % ('interactive', self.total() * 1000))
+        out.flush()
+
+
+class LatencyTrace(object):
+    '''Collect time from a key press until the frame showing its effect is
+    on the screen.
+    '''
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.samples = []
+
+    def add(self, seconds):
+        if self.enabled:
+            self.samples.append(seconds)
+
+    def report(self, out=None):
+        if not self.enabled:
+            return
+        out = out or sys.stderr
+        if not self.samples:
+            out.write('input latency: no key presses\n')
+            out.flush()
+            return
+        samples = sorted(self.samples)
+        average = sum(samples) / len(samples)
+        percentile = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        out.write('input latency: %d key presses\n' % len(samples))
+        out.write('  %-16s %8.1f ms\n' % ('average', average * 1000))
+        out.write('  %-16s %8.1f ms\n' % ('95th percentile', percentile * 1000))
+        out.write('  %-16s %8.1f ms\n' % ('worst', samples[-1] * 1000))
+        out.flush()
+
+
+class BlitTrace(object):
+    '''Count blits of each drawing layer and how many of them need per
+    pixel alpha blending.
+    '''
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.frames = 0
+        self.layers = {}
+        self.order = []
+
+    def frame(self):
+        self.frames += 1
+
+    def add(self, layer, blits, alpha):
+        if layer not in self.layers:
+            self.layers[layer] = [0, 0]
+            self.order.append(layer)
+        self.layers[layer][0] += blits
+        self.layers[layer][1] += alpha
+
+    def report(self, kinds=None, out=None):
+        '''Write average blits per frame, "kinds" maps images to the way
+        they are drawn.
+        '''
+        if not self.enabled:
+            return
+        out = out or sys.stderr
+        frames = max(self.frames, 1)
+        out.write('blits per frame (%d frames):\n' % self.frames)
+        out.write('  %-16s %8s %8s\n' % ('layer', 'all', 'alpha'))
+        for layer in self.order:
+            (blits, alpha) = self.layers[layer]
+            out.write('  %-16s %8.1f %8.1f\n' % (layer, blits / frames, alpha / frames))
+        if kinds:
+            out.write('alpha blended images:\n')
+            for (name, size) in sorted(kinds, key=str):
+                if kinds[(name, size)] == 'alpha':
+                    label = 'full' if size is None else '%dx%d' % size
+                    out.write('  %s %s\n' % (name, label))
+        out.flush()
+
+
+class MemoryTrace(object):
+    '''Measure memory allocated by each phase of a frame and pauses of the
+    garbage collector.
+
+    Allocations are tracked by tracemalloc, which sees only memory allocated
+    by Python, not pixels of pygame surfaces. A phase is charged with the
+    peak of traced memory above the amount traced when it started, so memory
+    allocated and freed again within the phase counts too. The first
+    "warmup" frames, while caches fill up, are not counted.
+    '''
+    def __init__(self, enabled=True, warmup=250):
+        self.enabled = enabled
+        self.warmup = warmup
+        self.frames = 0
+        self.base = 0
+
+        # phase -> [bytes allocated in all counted frames, most in one frame]
+        self.phases = {}
+        self.order = []
+
+        # bytes allocated by each counted frame
+        self.totals = []
+        self.allocated = 0
+
+        # generation -> durations of collections, in seconds
+        self.pauses = {}
+        self.collecting = None
+
+        # traced memory when counting started and at the end, to find what
+        # keeps growing
+        self.snapshot = None
+        self.final = None
+
+    def start(self):
+        if not self.enabled:
+            return
+        tracemalloc.start()
+        gc.callbacks.append(self.collected)
+        self.restart()
+
+    def stop(self):
+        if not self.enabled or not tracemalloc.is_tracing():
+            return
+        self.final = tracemalloc.take_snapshot()
+        gc.callbacks.remove(self.collected)
+        tracemalloc.stop()
+
+    def restart(self):
+        tracemalloc.reset_peak()
+        self.base = tracemalloc.get_traced_memory()[0]
+
+    def collected(self, phase, info):
+        # gc callback, called when collection starts and stops
+        if phase == 'start':
+            self.collecting = time.perf_counter()
+        elif self.collecting is not None:
+            if self.frames >= self.warmup:
+                self.pauses.setdefault(info['generation'], []).append(time.perf_counter() - self.collecting)
+            self.collecting = None
+
+    def mark(self, phase):
+        '''Charge allocations since the previous mark to phase.
+        '''
+        if not self.enabled:
+            return
+        allocated = tracemalloc.get_traced_memory()[1] - self.base
+        if self.frames >= self.warmup:
+            if phase not in self.phases:
+                self.phases[phase] = [0, 0]
+                self.order.append(phase)
+            self.phases[phase][0] += allocated
+            self.phases[phase][1] = max(self.phases[phase][1], allocated)
+            self.allocated += allocated
+        self.restart()
+
+    def frame(self):
+        if not self.enabled:
+            return
+        if self.frames >= self.warmup:
+            self.totals.append(self.allocated)
+        self.allocated = 0
+        self.frames += 1
+        if self.frames == self.warmup:
+            self.snapshot = tracemalloc.take_snapshot()
+        self.restart()
+
+    def average(self):
+        '''Bytes allocated per counted frame.
+        '''
+        return sum(self.totals) / max(len(self.totals), 1)
+
+    def percentile(self, fraction=0.95):
+        '''Bytes which the given fraction of counted frames allocate at most.
+        '''
+        if not self.totals:
+            return 0
+        totals = sorted(self.totals)
+        return totals[min(len(totals) - 1, int(len(totals) * fraction))]
+
+    def report(self, out=None):
+        if not self.enabled:
+            return
+        out = out or sys.stderr
+        counted = len(self.totals)
+        if not counted:
+            out.write('memory: no frames after %d warm up frames\n' % self.warmup)
+            out.flush()
+            return
+
+        out.write('allocated per frame (%d frames after %d warm up frames):\n' % (counted, self.warmup))
+        out.write('  %-16s %8s %8s\n' % ('phase', 'average', 'most'))
+        for phase in self.order:
+            (total, most) = self.phases[phase]
+            out.write('  %-16s %6.1f kB %6.1f kB\n' % (phase, total / counted / 1024, most / 1024))
+        out.write('  %-16s %6.1f kB %6.1f kB\n' % ('frame', self.average() / 1024, max(self.totals) / 1024))
+        out.write('  %-16s %6.1f kB\n' % ('95th percentile', self.percentile(0.95) / 1024))
+
+        out.write('garbage collection:\n')
+        out.write('  %-16s %8s %8s %8s\n' % ('generation', 'count', 'average', 'worst'))
+        for generation in range(0, 3):
+            pauses = self.pauses.get(generation, [])
+            average = sum(pauses) / max(len(pauses), 1)
+            out.write('  %-16d %8d %5.2f ms %5.2f ms\n' % (generation, len(pauses), average * 1000, max(pauses or [0]) * 1000))
+
+        if self.snapshot is not None and self.final is not None:
+            out.write('memory kept since warm up, by line:\n')
+            ignored = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+            final = self.final.filter_traces(ignored)
+            for stat in final.compare_to(self.snapshot.filter_traces(ignored), 'lineno')[:10]:
+                if stat.size_diff <= 0:
+                    break
+                frame = stat.traceback[0]
+                out.write('  %+8.1f kB %s:%d\n' % (stat.size_diff / 1024, frame.filename, frame.lineno))
+        out.flush()
+
+
+def rss():
+    '''Memory used by the process (resident set size) in bytes.
+
+    Peak instead of current use where /proc is not available.
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class SoakTrace(object):
+    '''Record how values change over a long run and find the ones which keep
+    growing.
+
+    Every "interval" seconds the values passed to sample() are recorded
+    together with average and worst frame time since the previous sample.
+    First tenth of the run is left out, while caches are filling up. A value
+    is growing when its average over the last third of the remaining
+    samples is bigger than over the first third by more than "tolerance"
+    (relative) plus its noise floor from "floors".
+    '''
+    def __init__(self, interval=10.0, tolerance=0.1, floors=None, enabled=True):
+        self.enabled = enabled
+        self.interval = interval
+        self.tolerance = tolerance
+        self.floors = floors or {}
+        self.start = self.last = time.perf_counter()
+        self.frame_times = []
+        self.names = []
+        self.samples = []
+
+    def frame(self, seconds):
+        # frame times are only collected between samples
+        if not self.enabled:
+            return
+        self.frame_times.append(seconds)
+
+    def due(self):
+        return self.enabled and time.perf_counter() - self.last >= self.interval
+
+    def sample(self, values):
+        now = time.perf_counter()
+        row = {}
+        if self.frame_times:
+            row['frame ms'] = sum(self.frame_times) / len(self.frame_times) * 1000
+            row['worst frame ms'] = max(self.frame_times) * 1000
+        row.update(values)
+        for name in row:
+            if name not in self.names:
+                self.names.append(name)
+        self.samples.append((now - self.start, row))
+        self.frame_times = []
+        self.last = now
+
+    def growing(self):
+        '''Return list of (name, first third average, last third average).
+        '''
+        samples = [row for (seconds, row) in self.samples[len(self.samples) // 10:]]
+        third = len(samples) // 3
+        if third == 0:
+            return []
+
+        found = []
+        for name in self.names:
+            first = [row[name] for row in samples[:third] if name in row]
+            last = [row[name] for row in samples[-third:] if name in row]
+            if not first or not last:
+                continue
+            (first, last) = (sum(first) / len(first), sum(last) / len(last))
+            if last > first + abs(first) * self.tolerance + self.floors.get(name, 0):
+                found.append((name, first, last))
+        return found
+
+    def write_log(self, filename):
+        # samples as CSV, one row per sample
+        with open(filename, 'w') as f:
+            f.write(','.join(['seconds'] + self.names) + '\n')
+            for (seconds, row) in self.samples:
+                f.write(','.join(['%.1f' % seconds] + ['%g' % row[name] if name in row else '' for name in self.names]) + '\n')
+
+    def report(self, out=None):
+        if not self.enabled:
+            return
+        out = out or sys.stderr
+        out.write('soak test: %d samples over %.1f minutes\n' % (len(self.samples), (self.last - self.start) / 60))
+
+        # at most about 20 rows, evenly picked
+        step = max(1, len(self.samples) // 20)
+        rows = self.samples[::step]
+        if self.samples and rows[-1] is not self.samples[-1]:
+            rows.append(self.samples[-1])
+        widths = [max(len(name), 8) for name in self.names]
+        out.write('  %8s %s\n' % ('minutes', ' '.join(name.rjust(width) for (name, width) in zip(self.names, widths))))
+        for (seconds, row) in rows:
+            cells = [('%.1f' % row[name] if name in row else '').rjust(width) for (name, width) in zip(self.names, widths)]
+            out.write('  %8.1f %s\n' % (seconds / 60, ' '.join(cells)))
+
+        growing = self.growing()
+        for (name, first, last) in growing:
+            out.write('growing: %s from %.1f to %.1f\n' % (name, first, last))
+        if not growing:
+            out.write('nothing keeps growing\n')
+        out.flush()
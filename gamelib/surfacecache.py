@@ -0,0 +1,127 @@
+'''On-disk cache of converted and scaled sprites.
+
+Decoding PNG files and scaling them is the slowest part of setting up the
+sprites. Finished surfaces are saved as raw pixel buffers in display format
+and on the next start loaded with pygame.image.frombuffer() instead.
+
+Entries are keyed by sprite name, hash of the source file and target size,
+so changing an asset invalidates its cached surfaces automatically.
+'''
+
+import os
+import sys
+import struct
+import hashlib
+import threading
+import pygame
+
+cache_dir = os.path.join(
+        os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+        'pirate-flow', 'surfaces')
+
+# pixel format, width and height in front of the pixels
+header = struct.Struct('<4sII')
+
+
+def source_hash(content):
+    '''Hash of a source image file contents.
+    '''
+    return hashlib.sha1(content).hexdigest()[:16]
+
+def pixel_format(surface):
+    '''Name of surface pixel layout as used by frombuffer(), or None if
+    the surface can't be stored as is.
+    '''
+    if surface.get_bitsize() != 32:
+        return None
+    masks = surface.get_masks()
+    if masks == (0xff0000, 0xff00, 0xff, 0xff000000):
+        return 'BGRA' if sys.byteorder == 'little' else 'ARGB'
+    if masks == (0xff, 0xff00, 0xff0000, 0xff000000):
+        return 'RGBA' if sys.byteorder == 'little' else 'ABGR'
+    return None
+
+
+class SurfaceCache(object):
+    def __init__(self, path=cache_dir, enabled=True):
+        self.path = path
+        self.enabled = enabled
+        self.entries = None
+        self.lock = threading.Lock()
+
+        # pixel buffers have to outlive surfaces created from them
+        self.buffers = []
+
+    def filename(self, name, digest, size):
+        label = 'full' if size is None else '%dx%d' % size
+        return '%s-%s-%s.raw' % (name, digest, label)
+
+    def listing(self):
+        with self.lock:
+            if self.entries is None:
+                try:
+                    self.entries = set(os.listdir(self.path))
+                except OSError:
+                    self.entries = set()
+            return self.entries
+
+    def load_all(self, name, digest):
+        '''Return all cached surfaces of a sprite as {size: surface}.
+        '''
+        surfaces = {}
+        if not self.enabled:
+            return surfaces
+
+        prefix = '%s-%s-' % (name, digest)
+        for filename in self.listing():
+            if not filename.startswith(prefix) or not filename.endswith('.raw'):
+                continue
+            label = filename[len(prefix):-len('.raw')]
+            if label == 'full':
+                size = None
+            else:
+                size = tuple(int(n) for n in label.split('x'))
+
+            try:
+                with open(os.path.join(self.path, filename), 'rb') as f:
+                    content = f.read()
+                (fmt, width, height) = header.unpack_from(content)
+                pixels = memoryview(content)[header.size:]
+                surfaces[size] = pygame.image.frombuffer(pixels, (width, height), fmt.decode('ascii'))
+            except (OSError, ValueError, struct.error):
+                continue
+            self.buffers.append(content)
+        return surfaces
+
+    def save(self, name, digest, size, surface):
+        if not self.enabled:
+            return
+        fmt = pixel_format(surface)
+        if fmt is None:
+            return
+
+        filename = self.filename(name, digest, size)
+        path = os.path.join(self.path, filename)
+        try:
+            os.makedirs(self.path, exist_ok=True)
+
+            # write to temporary file first so a half written entry is never
+            # picked up by another running game
+            with open(path + '.tmp', 'wb') as f:
+                f.write(header.pack(fmt.encode('ascii'), surface.get_width(), surface.get_height()))
+                f.write(pygame.image.tostring(surface, fmt))
+            os.replace(path + '.tmp', path)
+        except OSError:
+            return
+
+        # remove entries made from previous versions of the same image
+        entries = self.listing()
+        for stale in list(entries):
+            parts = stale.rsplit('-', 2)
+            if len(parts) == 3 and parts[0] == name and parts[1] != digest:
+                try:
+                    os.remove(os.path.join(self.path, stale))
+                except OSError:
+                    pass
+                entries.discard(stale)
+        entries.add(filename)
@@ -0,0 +1,220 @@
+#! /usr/bin/env python
+'''Generate big random levels for measuring how the game scales.
+
+Levels are written in the same format as data/levels/1.map. Islands are
+rectangles of grass surrounded by a ring of sand and a ring of beach, so
+every sand and beach tile resolves to one of the shipped autotile sprites.
+Cannons stand on the grass next to the sand, so each of them has water
+three tiles away.
+
+The map is placed on a grid of cells, at most one island per cell, and is
+written one row of cells at a time, so even 10000x10000 levels take little
+memory. The same seed always gives the same level.
+'''
+
+import time
+import random
+import argparse
+
+# size of the grid cell holding one island, islands keep one tile of water
+# to the cell border so they never touch
+CELL = 24
+
+# smallest island is a single grass tile inside sand and beach rings
+MIN_ISLAND = 5
+
+# tiles which are written as single bytes while a band is built
+PLAYER = b'P'
+HEART = b'H'
+
+LEGEND = '''[★]
+name = player
+complex = yes
+
+[.]
+name = water
+complex = no
+
+[#]
+name = sand
+complex = yes
+
+[~]
+name = grass
+complex = no
+
+[^]
+name = beach
+complex = yes
+
+[c]
+name = cannon
+complex = yes
+act_as = ~
+
+[❤]
+name = heart
+complex = yes
+act_as = .
+
+[M]
+name = medal
+complex = yes
+act_as = .
+
+[S]
+name = ship
+complex = yes
+act_as = .
+'''
+
+
+def island(band, left, top, width, height, cannons, rand):
+    '''Draw island into band (list of bytearray rows), return number of
+    cannons placed.
+    '''
+    for y in range(top, top + height):
+        row = band[y]
+        if y == top or y == top + height - 1:
+            row[left:left + width] = b'^' * width
+        elif y == top + 1 or y == top + height - 2:
+            row[left:left + width] = b'^' + b'#' * (width - 2) + b'^'
+        else:
+            row[left:left + width] = b'^#' + b'~' * (width - 4) + b'#^'
+
+    # cannons stand on grass touching the sand ring
+    placed = 0
+    edge = []
+    for x in range(left + 2, left + width - 2):
+        edge.append((x, top + 2))
+        edge.append((x, top + height - 3))
+    for y in range(top + 3, top + height - 3):
+        edge.append((left + 2, y))
+        edge.append((left + width - 3, y))
+    for (x, y) in edge:
+        if band[y][x] == ord('~') and rand.random() < cannons:
+            band[y][x] = ord('c')
+            placed += 1
+    return placed
+
+
+def scatter(band, width, count, tile, rand):
+    '''Put count tiles into random water places of band, return how many
+    were placed.
+    '''
+    placed = 0
+    for attempt in range(count * 4):
+        if placed == count:
+            break
+        (x, y) = (rand.randrange(1, width - 1), rand.randrange(0, len(band)))
+        if band[y][x] == ord('.'):
+            band[y][x] = tile[0]
+            placed += 1
+    return placed
+
+
+def amount(density, area, rand):
+    '''Number of objects in area, density is objects per tile.
+    '''
+    expected = density * area
+    count = int(expected)
+    if rand.random() < expected - count:
+        count += 1
+    return count
+
+
+def generate(out, width, height, seed=None, islands=0.6, cannons=0.15,
+             ships=0.002, hearts=0.0005, medals=0.0005):
+    '''Write a level of width x height tiles to out (binary file) and return
+    counts of placed objects.
+    '''
+    rand = random.Random(seed)
+    stats = {'islands': 0, 'cannons': 0, 'ships': 0, 'hearts': 0, 'medals': 0}
+
+    columns = max(1, width // CELL)
+    rows = max(1, height // CELL)
+    player = (rand.randrange(columns), rand.randrange(rows))
+
+    out.write(b'[level]\nmap = ')
+    first = True
+    for cell_y in range(0, rows):
+        # last band takes the rows which do not fill a whole cell
+        top = cell_y * CELL
+        bottom = height if cell_y == rows - 1 else top + CELL
+        band = [bytearray(b'.' * width) for y in range(top, bottom)]
+
+        for cell_x in range(0, columns):
+            left = cell_x * CELL
+            right = width if cell_x == columns - 1 else left + CELL
+            if (cell_x, cell_y) == player:
+                # empty cell, so player can sail away in any direction
+                band[(bottom - top) // 2][(left + right) // 2] = PLAYER[0]
+                continue
+            if rand.random() >= islands:
+                continue
+
+            # island keeps one tile of water to cell border
+            space_x = right - left - 2
+            space_y = bottom - top - 2
+            if space_x < MIN_ISLAND or space_y < MIN_ISLAND:
+                continue
+            island_width = rand.randint(MIN_ISLAND, space_x)
+            island_height = rand.randint(MIN_ISLAND, space_y)
+            x = left + 1 + rand.randint(0, space_x - island_width)
+            y = 1 + rand.randint(0, space_y - island_height)
+            stats['cannons'] += island(band, x, y, island_width, island_height, cannons, rand)
+            stats['islands'] += 1
+
+        area = width * (bottom - top)
+        stats['ships'] += scatter(band, width, amount(ships, area, rand), b'S', rand)
+        stats['hearts'] += scatter(band, width, amount(hearts, area, rand), HEART, rand)
+        stats['medals'] += scatter(band, width, amount(medals, area, rand), b'M', rand)
+
+        for row in band:
+            if not first:
+                out.write(b'      ')
+            first = False
+            row = bytes(row).replace(PLAYER, '★'.encode('utf-8')).replace(HEART, '❤'.encode('utf-8'))
+            out.write(row + b'\n')
+
+    out.write(LEGEND.encode('utf-8'))
+    return stats
+
+
+def size(text):
+    # WIDTHxHEIGHT command line argument
+    try:
+        (width, height) = [int(n) for n in text.lower().split('x')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('size must look like 1000x1000')
+    if not (CELL <= width <= 10000 and CELL <= height <= 10000):
+        raise argparse.ArgumentTypeError('width and height must be between %d and 10000' % CELL)
+    return (width, height)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate random Pirate Flow level')
+    parser.add_argument('filename', help='map file to write')
+    parser.add_argument('--size', type=size, default='1000x1000',
+                        help='level size in tiles (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed, same seed gives same level (default: %(default)s)')
+    parser.add_argument('--islands', type=float, default=0.6,
+                        help='chance of island in each %dx%d cell (default: %%(default)s)' % (CELL, CELL))
+    parser.add_argument('--cannons', type=float, default=0.15,
+                        help='chance of cannon on each grass tile along island shore (default: %(default)s)')
+    parser.add_argument('--ships', type=float, default=0.002,
+                        help='ships per tile (default: %(default)s)')
+    parser.add_argument('--hearts', type=float, default=0.0005,
+                        help='hearts per tile (default: %(default)s)')
+    parser.add_argument('--medals', type=float, default=0.0005,
+                        help='medals per tile (default: %(default)s)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    (width, height) = args.size
+    with open(args.filename, 'wb') as out:
+        stats = generate(out, width, height, args.seed, args.islands, args.cannons,
+                         args.ships, args.hearts, args.medals)
+    print('Wrote %dx%d level to %s in %.1f s' % (width, height, args.filename, time.perf_counter() - start))
+    print(', '.join('%d %s' % (stats[name], name) for name in sorted(stats)))
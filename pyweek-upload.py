@@ -2,149 +2,176 @@
 Upload script specifically engineered for the PyWeek challenge.
 
 Handles authentication and gives upload progress feedback.
+
+The request body is streamed from disk in large chunks, so memory use does
+not depend on the size of the uploaded file. If the connection breaks
+while uploading, the script reconnects and sends the request again.
 '''
-import sys, os, httplib, cStringIO, socket, time, getopt
+import sys, os, http.client, time, getopt
+
+# size of file chunks read from disk and sent to the server
+CHUNK_SIZE = 256 * 1024
+
+# how many times to reconnect after a broken connection
+RETRIES = 3
 
 class Upload:
     def __init__(self, filename):
         self.filename = filename
 
 boundary = '--------------GHSKFJDLGDS7543FJKLFHRE75642756743254'
-sep_boundary = '\n--' + boundary
-end_boundary = sep_boundary + '--'
+sep_boundary = b'\n--' + boundary.encode('ascii')
+end_boundary = sep_boundary + b'--'
+
+class MultipartBody:
+    '''Body of a multipart/form-data message built from the mapping of data.
+
+    Form fields are kept in memory, uploaded files are only read from disk
+    while the body is being sent.
+    '''
+    def __init__(self, data, sep_boundary=sep_boundary, end_boundary=end_boundary):
+        self.parts = []
+        for key, value in data.items():
+            # handle multiple entries for the same name
+            if type(value) != type([]): value = [value]
+            for value in value:
+                header = '\nContent-Disposition: form-data; name="%s"'%key
+                if isinstance(value, Upload):
+                    header += '; filename="%s"\n\n'%os.path.basename(value.filename)
+                    self.parts.append(sep_boundary + header.encode('utf-8'))
+                    self.parts.append(value)
+                    last = self.last_byte(value.filename)
+                else:
+                    value = str(value).encode('utf-8')
+                    self.parts.append(sep_boundary + (header + '\n\n').encode('utf-8') + value)
+                    last = value[-1:]
+                if last == b'\r':
+                    self.parts.append(b'\n')  # write an extra newline
+        self.parts.append(end_boundary)
+
+    def last_byte(self, filename):
+        with open(filename, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return b''
+            f.seek(-1, os.SEEK_END)
+            return f.read(1)
+
+    def __len__(self):
+        size = 0
+        for part in self.parts:
+            if isinstance(part, Upload):
+                size += os.path.getsize(part.filename)
+            else:
+                size += len(part)
+        return size
+
+    def chunks(self, size=CHUNK_SIZE):
+        for part in self.parts:
+            if not isinstance(part, Upload):
+                yield part
+                continue
+            with open(part.filename, 'rb') as f:
+                while True:
+                    chunk = f.read(size)
+                    if not chunk:
+                        break
+                    yield chunk
 
 def mimeEncode(data, sep_boundary=sep_boundary, end_boundary=end_boundary):
     '''Take the mapping of data and construct the body of a
     multipart/form-data message with it using the indicated boundaries.
     '''
-    ret = cStringIO.StringIO()
-    for key, value in data.items():
-        # handle multiple entries for the same name
-        if type(value) != type([]): value = [value]
-        for value in value:
-            ret.write(sep_boundary)
-            if isinstance(value, Upload):
-                ret.write('\nContent-Disposition: form-data; name="%s"'%key)
-                filename = os.path.basename(value.filename)
-                ret.write('; filename="%s"\n\n'%filename)
-                value = open(os.path.join(value.filename), "rb").read()
-            else:
-                ret.write('\nContent-Disposition: form-data; name="%s"'%key)
-                ret.write("\n\n")
-                value = str(value)
-            ret.write(str(value))
-            if value and value[-1] == '\r':
-                ret.write('\n')  # write an extra newline
-    ret.write(end_boundary)
-    return ret.getvalue()
+    return MultipartBody(data, sep_boundary, end_boundary)
 
 class Progress:
-    def __init__(self, info, data):
+    def __init__(self, info, tosend):
         self.info = info
-        self.tosend = len(data)
-        self.total = self.tosend/1024
-        self.data = cStringIO.StringIO(data)
-        self.start = self.now = time.time()
+        self.tosend = tosend
+        self.start = time.time()
         self.sent = 0
-        self.num = 0
-        self.stepsize = self.total / 100 or 1
-        self.steptimes = []
         self.display()
 
-    def __iter__(self): return self
-
-    def next(self):
-        self.num += 1
-        if self.sent >= self.tosend:
-            print self.info, 'done', ' '*(75-len(self.info)-6)
-            sys.stdout.flush()
-            raise StopIteration
-
-        chunk = self.data.read(1024)
-        self.sent += len(chunk)
-        #print (self.num, self.stepsize, self.total, self.sent, self.tosend)
-
-        if self.num % self.stepsize:
-            return chunk
+    def update(self, sent):
+        self.sent += sent
         self.display()
-        return chunk
+
+    def done(self):
+        print(self.info, 'done', ' '*(75-len(self.info)-6))
+        sys.stdout.flush()
 
     def display(self):
         # figure how long we've spent - guess how long to go
         now = time.time()
-        steptime = now - self.now
-        self.steptimes.insert(0, steptime)
-        if len(self.steptimes) > 5:
-            self.steptimes.pop()
-        steptime = sum(self.steptimes) / len(self.steptimes)
-        self.now = now
-        eta = steptime * ((self.total - self.num)/self.stepsize)
+        elapsed = now - self.start
+        if self.sent and elapsed:
+            eta = (self.tosend - self.sent) * elapsed / self.sent
+        else:
+            eta = 0
+        percent = self.tosend and self.sent * 100. / self.tosend
 
         # tell it like it is (or might be)
-        if now - self.start > 3:
+        if elapsed > 3:
             M = eta / 60
             H = M / 60
             M = M % 60
             S = eta % 60
-            if self.total:
-                s = '%s %2d%% (ETA %02d:%02d:%02d)'%(self.info,
-                    self.num * 100. / self.total, H, M, S)
-            else:
-                s = '%s 0%% (ETA %02d:%02d:%02d)'%(self.info, H, M, S)
-        elif self.total:
-            s = '%s %2d%%'%(self.info, self.num * 100. / self.total)
+            s = '%s %2d%% (ETA %02d:%02d:%02d)'%(self.info, percent, H, M, S)
         else:
-            s = '%s %d done'%(self.info, self.num)
+            s = '%s %2d%%'%(self.info, percent)
         sys.stdout.write(s + ' '*(75-len(s)) + '\r')
         sys.stdout.flush()
 
-class progressHTTPConnection(httplib.HTTPConnection):
-    def progress_send(self, str):
-        """Send `str' to the server."""
+class progressHTTPConnection(http.client.HTTPConnection):
+    def progress_send(self, body):
+        """Stream `body' to the server."""
         if self.sock is None:
             self.connect()
 
-        p = Progress('Uploading', str)
-        for chunk in p:
-            sent = 0
-            while sent != len(chunk):
-                try:
-                    sent += self.sock.send(chunk)
-                except socket.error, v:
-                    if v[0] == 32:      # Broken pipe
-                        self.close()
-                    raise
-                p.display()
-
-class progressHTTP(httplib.HTTP):
-    _connection_class = progressHTTPConnection
-    def _setup(self, conn):
-        httplib.HTTP._setup(self, conn)
-        self.progress_send = self._conn.progress_send
+        p = Progress('Uploading', len(body))
+        for chunk in body.chunks():
+            self.sock.sendall(chunk)
+            p.update(len(chunk))
+        p.done()
 
 def http_request(data, server, port, url):
-    h = progressHTTP(server, port)
-
-    data = mimeEncode(data)
-    h.putrequest('POST', url)
-    h.putheader('Content-type', 'multipart/form-data; boundary=%s'%boundary)
-    h.putheader('Content-length', str(len(data)))
-    h.putheader('Host', server)
-    h.endheaders()
-
-    h.progress_send(data)
+    '''POST data to the server and return (status, reason, response).
 
-    errcode, errmsg, headers = h.getreply()
-
-    f = h.getfile()
-    response = f.read().strip()
-    f.close()
-
-    print '%s %s'%(errcode, errmsg)
-    if response: print response
+    Reusing a connection between requests is not supported, each call
+    opens its own and closes it when done. When the connection breaks,
+    the same HTTPConnection connects again and sends the whole body again,
+    the server can't continue a partly received upload.
+    '''
+    body = mimeEncode(data)
+    h = progressHTTPConnection(server, port)
+
+    for attempt in range(RETRIES + 1):
+        try:
+            h.putrequest('POST', url)
+            h.putheader('Content-type', 'multipart/form-data; boundary=%s'%boundary)
+            h.putheader('Content-length', str(len(body)))
+            h.endheaders()
+
+            h.progress_send(body)
+
+            r = h.getresponse()
+            response = r.read().strip()
+            h.close()
+            break
+        except (BrokenPipeError, ConnectionResetError, http.client.RemoteDisconnected) as e:
+            # start the request again on a fresh connection
+            h.close()
+            if attempt == RETRIES:
+                raise
+            print()
+            print('Connection lost (%s), retrying'%e)
+
+    print('%s %s'%(r.status, r.reason))
+    if response: print(response.decode('utf-8', 'replace'))
+    return (r.status, r.reason, response)
 
 def usage():
-    print '''This program is to be used to upload files to the PyWeek system.
+    print('''This program is to be used to upload files to the PyWeek system.
 You may use it to upload screenshots or code submissions.
 
 REQUIRED ARGUMENTS:
@@ -162,14 +189,14 @@ OPTIONAL ARGUMENTS:
 
 In order to qualify for judging at the end of the challenge, you MUST
 upload your source and check the "Final Submission" checkbox.
-'''
+''')
 
 
 if __name__ == '__main__':
     try:
         optlist, args = getopt.getopt(sys.argv[1:], 'e:u:p:sfd:h:P:c:')
-    except getopt.GetoptError, message:
-        print message
+    except getopt.GetoptError as message:
+        print(message)
         usage()
         sys.exit(1)
     host = 'www.pyweek.org'
@@ -189,10 +216,9 @@ if __name__ == '__main__':
         elif opt == '-P': port = int(arg)
 
     if len(data) < 4 or url is None:
-        print 'Required argument missing'
+        print('Required argument missing')
         usage()
         sys.exit(1)
 
     data.update(optional)
     http_request(data, host, port, url)
-
@@ -1,11 +1,27 @@
 #! /usr/bin/env python
 
+import time
+START_TIME = time.perf_counter()
+
 import os
+import sys
+import copy
 import math
+import heapq
+import array
+import json
+import struct
+import hashlib
 import random
+import operator
+import itertools
+import argparse
 import configparser
+import threading
+import collections
 import pygame
 import pygame.locals
+from gamelib import atlas, data, profiling, surfacecache
 
 # constants
 SCREEN_WIDTH = 928
@@ -13,19 +29,717 @@ SCREEN_HEIGHT = 736
 TILE_WIDTH = 32
 TILE_HEIGHT = 32
 
+# game world is updated in steps of this many miliseconds (50 per second)
+FRAME_TIME = 20
+
+# adaptive pacing catches up at most this many steps before next frame is
+# drawn, any longer pause slows the game down instead
+MAX_STEPS = 5
+
+# effects are reduced when at least quarter of this many last frames were
+# late and restored once none of them were
+PACING_WINDOW = 50
+
+# how far (in tiles) cannons look for the player along their firing lanes
+CANNON_RANGE = 8
+
+# ships are indexed by square areas of this many tiles, ships in the
+# player's area and the ones around it are close enough to fire
+SHIP_AREA = 8
+
+# tile offsets of each direction objects can face
+DIRECTIONS = {
+    'left': (-1, 0),
+    'right': (1, 0),
+    'up': (0, -1),
+    'down': (0, 1)
+}
+
+# ships start chasing the player within this many tiles (by sea), closer
+# than flank distance they circle around it instead
+FLOW_RANGE = 20
+FLANK_DISTANCE = 3
+
+# how many tiles flow field visits per tick while it is being rebuilt
+FLOW_BUDGET = 2000
+
+# directions ships can turn to when flanking the player
+FLANKS = {
+    'left': ('up', 'down'),
+    'right': ('down', 'up'),
+    'up': ('right', 'left'),
+    'down': ('left', 'right')
+}
+
+# minimap fits into square of this size (in pixels), bigger maps are
+# sampled every few tiles
+MINIMAP_SIZE = 240
+MINIMAP_COLORS = {
+    'water': (60, 140, 200),
+    'beach': (120, 190, 225),
+    'sand': (235, 215, 150),
+    'grass': (90, 160, 70),
+    'player': (255, 255, 255),
+    'ship': (200, 30, 30),
+    'cannon': (40, 40, 40),
+    'heart': (255, 120, 170),
+    'medal': (255, 200, 0)
+}
+
+# transparent colour of images without translucent pixels
+COLORKEY = (255, 0, 255)
+
+# drawing order, from the bottom
+LAYERS = ('water', 'terrain', 'player', 'bullets', 'particles', 'items', 'cannons', 'ships', 'hud', 'text')
+
+# Python memory (in kB) 95% of frames of gameplay may allocate at most, see
+# check-memory.py. Autoplay measured 128-135 kB (about 118 kB on average);
+# the budget leaves about 20% on top of that, so the check does not fail
+# on noise between runs but on frames allocating noticeably more
+MEMORY_BUDGET = 160
+
+# sets of random directions kept for each count and speed of particles
+PARTICLE_VELOCITIES = 8
+
+# event posted by simulation thread when a new snapshot can be drawn
+SNAPSHOT_READY = pygame.locals.USEREVENT
+
+# sprites which are not needed until achievements screen is opened
+LAZY_SPRITES = ('shoot', 'world')
+
+# precompiled levels (made by check-levels.py) start with this line and are
+# stored next to the map with "c" appended to its name
+COMPILED_MAGIC = b'PFLEVEL1\n'
+
+
+# everything needed to draw one frame, entity groups are tuples of
+# (x, y, image), particles are columns (see Particles.snapshot), level is a
+# view which does not change (see Level.view)
+Snapshot = collections.namedtuple('Snapshot', [
+    'water', 'player', 'alive', 'bullets', 'particles', 'hearts', 'medals',
+    'cannons', 'ships', 'started', 'screen', 'energy', 'score', 'lost',
+    'show_minimap', 'goals', 'presses', 'level', 'minimap'
+])
+
+
+class Goal(object):
+    def __init__(self, name, event, target, title, unlocked, icon, over=False):
+        self.name = name
+        self.event = event
+        self.target = target
+        self.title = title
+        self.unlocked = unlocked
+        self.icon = icon
+
+        # should counter go over the target or is it enough to reach it
+        self.over = over
+
+        self.count = 0
+        self.reached = False
+
+    def update(self, value):
+        # value is new counter value or None to count one more event
+        if value is None:
+            self.count += 1
+        else:
+            self.count = value
+
+        if self.over:
+            return self.count > self.target
+        return self.count >= self.target
+
 
 class Achievements(object):
+    def __init__(self, game):
+        self.game = game
+
+        # player goals: name, game event counted, target, screen texts and icon
+        self.goals = [
+            Goal('cannons', 'cannon killed', 6,
+                 'Eliminate at least {} cannons', 'Unlocked! Cannons eliminated so far: {}', 'shoot'),
+            Goal('distance', 'tile moved', 700,
+                 'Travel {} miles', 'Unlocked! Traveled miles so far: {}', 'world'),
+            Goal('score', 'score changed', 3000,
+                 'Reach over {} score points', 'Unlocked!', 'medal', over=True),
+        ]
+
+        # goals affected by each event
+        self.events = {}
+        for goal in self.goals:
+            self.events.setdefault(goal.event, []).append(goal)
+
+    def notify(self, event, value=None):
+        for goal in self.events.get(event, ()):
+            if goal.update(value) and not goal.reached:
+                goal.reached = True
+
+                # play achievement unlocked song
+                self.game.assets.play('achievement', 0.3)
+
+
+class Assets(object):
     def __init__(self):
-        self.cannons_reached = False
-        self.cannons_goal = 6
-        self.cannons_killed = 0
+        # decoded images waiting for conversion to the display format
+        self.raw = {}
+
+        # converted (and scaled) images ready to be drawn
+        self.images = {}
+
+        # images loaded from surface cache, not yet converted
+        self.cached = {}
+
+        # how each image is drawn: opaque, colorkey or alpha
+        self.kinds = {}
+
+        # source file hashes, used as surface cache keys
+        self.hashes = {}
+        self.cache = surfacecache.SurfaceCache()
+
+        # texture atlas (see gamelib/atlas.py) and sprites in it:
+        # (name, size) -> rect
+        self.atlas = None
+        self.atlas_rects = {}
+        self.atlas_converted = False
+
+        self.sounds = {}
+
+        # simulation thread (see --threaded) makes images too
+        self.lock = threading.Lock()
+
+    def decode(self, name):
+        # safe to call from the loader thread - no display access here
+        content = data.read('sprites/' + name + '.png')
+        self.hashes[name] = surfacecache.source_hash(content)
+
+        # already converted and scaled surfaces from previous runs
+        cached = self.cache.load_all(name, self.hashes[name])
+        for size, image in cached.items():
+            self.cached[(name, size)] = image
+
+        if not cached:
+            self.raw[name] = pygame.image.load(data.load('sprites/' + name + '.png'), name + '.png')
+
+    def load_atlas(self):
+        # safe to call from the loader thread, atlas is converted on first use
+        loaded = atlas.load()
+        if loaded is not None:
+            (self.atlas, self.atlas_rects) = loaded
+
+    def image(self, name, size=None):
+        key = (name, size)
+        if key in self.images:
+            return self.images[key]
+        with self.lock:
+            # other thread might have made it in the meantime
+            if key not in self.images:
+                self.make(key)
+        return self.images[key]
+
+    def make(self, key):
+        (name, size) = key
+        if key in self.atlas_rects:
+            # sprites packed in the atlas are views into it
+            if not self.atlas_converted:
+                self.atlas = self.atlas.convert_alpha()
+                self.atlas_converted = True
+            image = self.atlas.subsurface(self.atlas_rects[key])
+        else:
+            image = self.scaled(name, size)
+
+        (self.kinds[key], self.images[key]) = self.optimize(image)
+
+    def scaled(self, name, size):
+        # sprite from its own file, or from the surface cache
+        key = (name, size)
+        if name not in self.hashes:
+            self.decode(name)
+        if key in self.cached:
+            return self.cached.pop(key)
+
+        if name not in self.raw:
+            self.raw[name] = pygame.image.load(data.load('sprites/' + name + '.png'), name + '.png')
+
+        image = self.raw[name].convert_alpha()
+        if size is not None:
+            image = pygame.transform.scale(image, size)
+        self.cache.save(name, self.hashes[name], size, image)
+        return image
+
+    def optimize(self, image):
+        # per pixel alpha blending is the slow path, so images without
+        # translucent pixels are converted to display format without alpha
+        (width, height) = image.get_size()
+        opaque = pygame.mask.from_surface(image, 254).count()
+        if opaque == width * height:
+            return ('opaque', image.convert())
+
+        # fully transparent pixels can be skipped with a colorkey, unless
+        # the key colour is used by the image itself
+        if opaque == pygame.mask.from_surface(image, 0).count():
+            keyed = pygame.Surface((width, height)).convert()
+            keyed.fill(COLORKEY)
+            keyed.blit(image, (0, 0))
+            keyed.set_colorkey(COLORKEY, pygame.RLEACCEL)
+            if pygame.mask.from_surface(keyed).count() == opaque:
+                return ('colorkey', keyed)
+        return ('alpha', image)
+
+    def load_sound(self, name):
+        self.sounds[name] = pygame.mixer.Sound(data.load('music/' + name + '.wav'))
+
+    def play(self, name, volume):
+        if name not in self.sounds:
+            self.load_sound(name)
+
+        # sounds are shared, so volume is set on the channel playing it
+        channel = self.sounds[name].play()
+        if channel is not None:
+            channel.set_volume(volume)
+
+
+class Loader(object):
+    def __init__(self, trace=None):
+        self.jobs = []
+        self.done = 0
+        self.error = None
+        self.trace = trace
+        self.thread = threading.Thread(target=self.run, name='loader')
+        self.thread.daemon = True
+
+    def add(self, phase, job, *args):
+        self.jobs.append((phase, job, args))
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        try:
+            for phase, job, args in self.jobs:
+                started = time.perf_counter()
+                job(*args)
+                if self.trace is not None:
+                    self.trace.add(phase, time.perf_counter() - started)
+                self.done += 1
+        except Exception as e:
+            self.error = e
+
+    def progress(self):
+        if not self.jobs:
+            return 100
+        return int(self.done * 100 / len(self.jobs))
+
+    def ready(self):
+        # re-raise loader failures on the main thread
+        if self.error is not None:
+            raise self.error
+        return self.done == len(self.jobs)
+
+
+class Scheduler(object):
+    def __init__(self):
+        # game time in miliseconds
+        self.now = 0
+
+        # heap of [deadline, order, callback, args]
+        self.events = []
+        self.order = 0
+
+    def schedule(self, delay, callback, *args):
+        self.order += 1
+        event = [self.now + delay, self.order, callback, args]
+        heapq.heappush(self.events, event)
+        return event
+
+    def cancel(self, event):
+        # cancelled events stay in the heap until they are due
+        if event is not None:
+            event[2] = None
+
+    def advance(self, elapsed):
+        # wake up only objects whose timers are due
+        self.now += elapsed
+        while self.events and self.events[0][0] <= self.now:
+            (deadline, order, callback, args) = heapq.heappop(self.events)
+            if callback is not None:
+                callback(*args)
+
+
+class Input(object):
+    def __init__(self, low_latency=False, trace=None):
+        # start next frame as soon as a key is pressed instead of waiting
+        # for the frame deadline
+        self.low_latency = low_latency
+        self.trace = trace
+
+        # events with time (perf_counter) they were taken from the queue
+        self.pending = []
+
+        # arrival times of key presses handled in current frame
+        self.presses = []
+        self.quit = False
+
+        # new window size if it was resized
+        self.resized = None
+
+    def wait(self, deadline, wake=()):
+        # sleep until frame deadline or one of wake events, but keep
+        # collecting events so we know when each key was pressed
+        if self.low_latency:
+            wake = tuple(wake) + (pygame.locals.KEYDOWN, pygame.locals.QUIT)
+        while True:
+            remaining = int((deadline - time.perf_counter()) * 1000)
+            if remaining < 1:
+                return
+            event = pygame.event.wait(remaining)
+            if event.type == pygame.locals.NOEVENT:
+                return
+            self.pending.append((event, time.perf_counter()))
+            if event.type in wake:
+                return
+
+    def poll(self):
+        # keys pressed since last frame, held keys repeated by the system
+        # are counted once per frame
+        now = time.perf_counter()
+        for event in pygame.event.get():
+            self.pending.append((event, now))
+
+        keys = []
+        for (event, arrived) in self.pending:
+            if event.type == pygame.locals.QUIT:
+                self.quit = True
+            elif event.type == pygame.locals.VIDEORESIZE:
+                self.resized = event.size
+            elif event.type == pygame.locals.KEYDOWN and event.key not in keys:
+                keys.append(event.key)
+                self.presses.append(arrived)
+        self.pending = []
+        return keys
+
+    def take(self):
+        # arrival times of keys returned by poll()
+        (presses, self.presses) = (self.presses, [])
+        return presses
+
+    def presented(self, presses):
+        # frame with reaction to these key presses is on the screen now
+        if self.trace is not None:
+            now = time.perf_counter()
+            for arrived in presses:
+                self.trace.add(now - arrived)
+
+
+class FramePacer(object):
+    def __init__(self, game, adaptive=False, fixed=False):
+        self.game = game
+        self.adaptive = adaptive
+
+        # update world in fixed steps, adaptive pacing always does
+        self.fixed = fixed or adaptive
+
+        # time which game world is behind the clock
+        self.lag = 0
+
+        self.frames = 0
+        self.dropped = 0
+        self.reductions = 0
+        self.late = collections.deque(maxlen=PACING_WINDOW)
+
+    def steps(self, elapsed):
+        # durations of world updates to run before next frame is drawn
+        self.frames += 1
+        if not self.fixed:
+            return [elapsed]
+
+        # catch up in fixed steps so game speed does not depend on how
+        # long drawing takes, frames are skipped instead
+        self.lag += elapsed
+        count = min(int(self.lag // FRAME_TIME), MAX_STEPS)
+        self.lag = min(self.lag - count * FRAME_TIME, FRAME_TIME)
+        if count > 1:
+            self.dropped += count - 1
+        self.late.append(count > 1)
+
+        if self.adaptive:
+            self.adapt()
+        return [FRAME_TIME] * count
+
+    def adapt(self):
+        # degrade optional animations only when overload lasts
+        late = sum(self.late)
+        if not self.game.reduced_effects and len(self.late) == PACING_WINDOW and late * 4 >= PACING_WINDOW:
+            self.game.reduced_effects = True
+            self.reductions += 1
+        elif self.game.reduced_effects and late == 0:
+            self.game.reduced_effects = False
+
+    def report(self, out=None):
+        if not self.adaptive:
+            return
+        out = out or sys.stderr
+        out.write('frame pacing: %d frames drawn, %d dropped, effects reduced %d times\n'
+                  % (self.frames, self.dropped, self.reductions))
+        out.flush()
+
+
+class Autoplay(object):
+    # plays instead of the player, so the game can be measured and left
+    # running without anybody playing: fires at cannons and ships in front
+    # of it, sails for hearts when hurt and for medals, patrols the level
+    # otherwise and starts again when the game is lost
+    def __init__(self, game, seed=0):
+        self.game = game
+        self.random = random.Random(seed)
+        self.frame = 0
+        self.waypoint = None
+        self.detour = []
+
+    def keys(self):
+        # one key every few frames, about as fast as keys repeat
+        self.frame += 1
+        if self.frame % 5:
+            return []
+        game = self.game
+        if not game.started or game.screen != 'gameplay' or game.player.has_lost():
+            return [pygame.K_SPACE]
+        player = game.player
+        if not player.is_alive or player.rotate_to is not None:
+            return []
+
+        if player.loaded and self.in_sight():
+            return [pygame.K_SPACE]
+
+        # sail around whatever blocked the way for a few tiles
+        if self.detour:
+            direction = self.detour.pop()
+            if self.can_sail(*DIRECTIONS[direction]):
+                return [self.key(direction)]
+            self.detour = []
+
+        target = self.target()
+        choices = []
+        for (direction, (dx, dy)) in DIRECTIONS.items():
+            # ship can't turn back in one go
+            if (dx, dy) == tuple(-n for n in DIRECTIONS[player.position]):
+                continue
+            if not self.can_sail(dx, dy):
+                continue
+            distance = abs(target[0] - player.x - dx) + abs(target[1] - player.y - dy)
+            choices.append((distance, self.random.random(), direction))
+        if not choices:
+            return []
+        (distance, order, direction) = min(choices)
+        if distance >= abs(target[0] - player.x) + abs(target[1] - player.y):
+            # no way closer, wander off in a random direction for a while
+            direction = self.random.choice(choices)[2]
+            self.detour = [direction] * self.random.randint(2, 6)
+            self.waypoint = None
+        return [self.key(direction)]
+
+    def key(self, direction):
+        return {'left': pygame.K_LEFT, 'right': pygame.K_RIGHT, 'up': pygame.K_UP, 'down': pygame.K_DOWN}[direction]
+
+    def can_sail(self, dx, dy):
+        # same rule as Player movement: next two tiles must not be sand, the
+        # ship can move both of them in one go so they must be in the level
+        (x, y) = (self.game.player.x, self.game.player.y)
+        for distance in (1, 2):
+            (next_x, next_y) = (x + dx * distance, y + dy * distance)
+            if not (0 <= next_x < self.game.level.width and 0 <= next_y < self.game.level.height):
+                return False
+            if self.game.level.get_tile(next_x, next_y)['name'] == 'sand':
+                return False
+        return True
+
+    def in_sight(self):
+        # enemy in the lane player's bullets fly
+        player = self.game.player
+        (dx, dy) = DIRECTIONS[player.position]
+        for enemy in self.game.cannons + self.game.ships:
+            (ahead, aside) = ((enemy.x - player.x) * dx + (enemy.y - player.y) * dy,
+                              abs((enemy.x - player.x) * dy) + abs((enemy.y - player.y) * dx))
+            if 0 < ahead <= player.fire_distance and aside <= 1:
+                return True
+        return False
+
+    def target(self):
+        player = self.game.player
+        items = self.game.medals
+        if player.energy < player.max_energy and self.game.hearts:
+            items = self.game.hearts
+        if items:
+            item = min(items, key=lambda item: abs(item.x - player.x) + abs(item.y - player.y))
+            return (item.x, item.y)
+
+        if self.waypoint is None or self.waypoint == (player.x, player.y):
+            self.waypoint = (self.random.randrange(self.game.level.width), self.random.randrange(self.game.level.height))
+        return self.waypoint
+
+
+class Simulation(threading.Thread):
+    def __init__(self, game):
+        threading.Thread.__init__(self, name='simulation', daemon=True)
+        self.game = game
+        self.stopped = threading.Event()
+        self.error = None
+
+        # key presses sent by the main thread: (keys, arrival times)
+        self.keys = collections.deque()
+
+        # double buffer: main thread draws front snapshot while next one
+        # is being built, published snapshots are never changed
+        self.lock = threading.Lock()
+        self.front = game.snapshot()
+        self.drawn = None
+
+    def send(self, keys, presses):
+        if keys or presses:
+            self.keys.append((keys, presses))
+
+    def latest(self):
+        # newest snapshot or None if it was already drawn
+        with self.lock:
+            if self.front is self.drawn:
+                return None
+            self.drawn = self.front
+            return self.front
+
+    def run(self):
+        try:
+            deadline = time.perf_counter()
+            while not self.stopped.is_set():
+                presses = []
+                while self.keys:
+                    (keys, arrived) = self.keys.popleft()
+                    for key in keys:
+                        self.game.press(key)
+                    presses.extend(arrived)
+
+                self.game.update(FRAME_TIME)
+                back = self.game.snapshot(presses)
+                with self.lock:
+                    self.front = back
+                pygame.event.post(pygame.event.Event(SNAPSHOT_READY))
+
+                # keep fixed pace, after a long stall do not try to catch up
+                # more than few steps
+                deadline += FRAME_TIME / 1000.0
+                delay = deadline - time.perf_counter()
+                if delay > 0:
+                    self.stopped.wait(delay)
+                elif delay < -MAX_STEPS * FRAME_TIME / 1000.0:
+                    deadline = time.perf_counter()
+        except Exception as e:
+            self.error = e
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def check(self):
+        # re-raise simulation errors in the main thread
+        if self.error is not None:
+            raise self.error
+
+
+class Display(object):
+    def __init__(self, resolution, window=None, fullscreen=False, smooth=False):
+        # game is always drawn on canvas of SCREEN_WIDTH x SCREEN_HEIGHT
+        # pixels, so every resolution shows the same tiles and layout;
+        # canvas is scaled to resolution and that to fit the window
+        self.resolution = resolution
+        self.smooth = smooth
+        self.flags = pygame.FULLSCREEN if fullscreen else pygame.RESIZABLE
+        self.canvas = None
+        self.frame = None
+        self.view = None
+        self.resize((0, 0) if fullscreen else (window or resolution))
+
+    def fit(self, size):
+        # biggest size fitting in size with the same shape as canvas
+        scale = min(size[0] / float(SCREEN_WIDTH), size[1] / float(SCREEN_HEIGHT))
+        return (int(SCREEN_WIDTH * scale), int(SCREEN_HEIGHT * scale))
+
+    def resize(self, size):
+        self.window = pygame.display.set_mode(size, self.flags | pygame.DOUBLEBUF, 32)
+        size = self.window.get_size()
+        frame = self.fit(self.resolution)
+
+        # no scaling needed, draw straight to the window
+        if size == (SCREEN_WIDTH, SCREEN_HEIGHT) and frame == size:
+            self.canvas = self.window
+            self.frame = None
+            self.view = None
+            return
+
+        if self.canvas is None or self.view is None:
+            self.canvas = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)).convert()
+
+        # rest of the window stays black
+        view = pygame.Rect((0, 0), self.fit(size))
+        view.center = (size[0] // 2, size[1] // 2)
+        self.window.fill((0, 0, 0))
+        self.view = self.window.subsurface(view)
+
+        # canvas is scaled straight into the window when resolution matches
+        # the window or the canvas, otherwise into a frame of resolution
+        # size first
+        if frame in (view.size, (SCREEN_WIDTH, SCREEN_HEIGHT)):
+            self.frame = None
+        else:
+            self.frame = pygame.Surface(frame).convert()
+
+    def present(self):
+        # scale canvas into the window and show it
+        if self.view is not None:
+            target = self.frame if self.frame is not None else self.view
+            if self.smooth:
+                pygame.transform.smoothscale(self.canvas, target.get_size(), target)
+            else:
+                pygame.transform.scale(self.canvas, target.get_size(), target)
+            if self.frame is not None:
+                pygame.transform.scale(self.frame, self.view.get_size(), self.view)
+        pygame.display.flip()
+
 
-        self.distance_reached = False
-        self.distance_goal = 700
-        self.distance_traveled = 0
+class LevelWatcher(object):
+    def __init__(self, game, filename, interval=250):
+        self.game = game
+        self.filename = filename
+        self.interval = interval
+        self.waited = 0
+        self.mtime = os.stat(filename).st_mtime_ns
+        with open(filename, 'rb') as f:
+            self.content = f.read()
+
+    def check(self, elapsed):
+        # file is checked a few times per second, not on every step
+        self.waited += elapsed
+        if self.waited < self.interval:
+            return
+        self.waited = 0
 
-        self.score_reached = False
-        self.score_goal = 3000
+        try:
+            mtime = os.stat(self.filename).st_mtime_ns
+            if mtime == self.mtime:
+                return
+            self.mtime = mtime
+            with open(self.filename, 'rb') as f:
+                content = f.read()
+        except OSError:
+            return
+        if content == self.content:
+            return
+
+        # half saved or broken map is reported and tried again on next save
+        start = time.perf_counter()
+        try:
+            changed = self.game.reload_level(self.content, content)
+        except (configparser.Error, UnicodeDecodeError, KeyError, IndexError) as e:
+            print('Level not reloaded: %s: %s' % (type(e).__name__, e))
+            return
+        self.content = content
+        print('Level reloaded: %d tiles changed in %.1f ms' % (changed, (time.perf_counter() - start) * 1000))
 
 
 class Game(object):
@@ -35,22 +749,39 @@ class Game(object):
         self.cannons = []
         self.hearts = []
         self.medals = []
-        self.explosions = []
         self.ships = []
 
-        # load player ship configuration
-        self.player = Player(self)
+        # ships by area (see SHIP_AREA) and cannons and ships which are
+        # turning round, only these need attention every step
+        self.ship_areas = collections.defaultdict(set)
+        self.rotating = set()
+        self.player_tile = None
+
+        # sprites and sounds shared by all game objects
+        self.assets = Assets()
+
+        # explosions and other effects
+        self.particles = Particles(self)
+
+        # keep at least this many particles flying, see --stress-particles
+        self.stress_particles = 0
 
-        # load level/map configuration
         self.level = Level(self)
-        self.level.load_file('./data/levels/1.map')
         self.clock = pygame.time.Clock()
+        self.clock_elapsed = 0
+        self.frame_start = time.perf_counter()
+
+        # frames are limited by tick() unless something else paces them
+        self.framerate = 1000 // FRAME_TIME
+
+        # key presses collected between frames
+        self.input = Input()
 
-        # fonts used in the game
-        self.small_font = pygame.font.Font('./data/fonts/font.ttf', 14)
-        self.regular_font = pygame.font.Font('./data/fonts/font.ttf', 16)
-        self.big_font = pygame.font.Font('./data/fonts/font.ttf', 24)
-        self.title_font = pygame.font.Font('./data/fonts/font.ttf', 64)
+        # timers of all game objects
+        self.scheduler = Scheduler()
+
+        # fonts are opened on first use, see font()
+        self.fonts = {}
 
         # has gameplay started?
         self.started = False
@@ -58,27 +789,347 @@ class Game(object):
         # game screen: gameplay, achievements
         self.screen = "gameplay"
 
-        # load background music
+        self.loader = None
+
+        # sea routes towards the player shared by all ships
+        self.flow = None
+
+        # draw commands of the current frame
+        self.render_queue = RenderQueue()
+
+        # level overview, toggled with M key
+        self.minimap = None
+        self.show_minimap = True
+
+        # water animation offset
+        self.water = 0
+
+        # skip optional animations when machine can't keep up
+        self.reduced_effects = False
+
+        # reloads level file when it changes, see --watch-level
+        self.watcher = None
+
+        # track player achievements
+        self.achievements = Achievements(self)
+
+    def font(self, size):
+        if size not in self.fonts:
+            self.fonts[size] = pygame.font.Font(data.load('fonts/font.ttf'), size)
+        return self.fonts[size]
+
+    # fonts used in the game
+    small_font = property(lambda self: self.font(14))
+    regular_font = property(lambda self: self.font(16))
+    big_font = property(lambda self: self.font(24))
+    title_font = property(lambda self: self.font(64))
+
+    def start_loading(self, trace=None, level='./data/levels/1.map'):
+        # sprites, sounds and level are loaded in the background while title
+        # screen is already shown
         pygame.mixer.init()
-        pygame.mixer.music.load("./data/music/bg.wav")
+        self.loader = Loader(trace)
+        self.loader.add('level', self.level.parse_file, level)
+        if data.exists(atlas.image_name):
+            # one image holds all sprites the game draws
+            self.loader.add('sprites', self.assets.load_atlas)
+        else:
+            for filename in data.listdir('sprites'):
+                name = filename[:-4]
+                if filename.endswith('.png') and name not in LAZY_SPRITES:
+                    self.loader.add('sprites', self.assets.decode, name)
+        for filename in data.listdir('music'):
+            if filename.endswith('.wav') and filename != 'bg.wav':
+                self.loader.add('sounds', self.assets.load_sound, filename[:-4])
+        self.loader.add('music', pygame.mixer.music.load, data.load('music/bg.wav'), 'bg.wav')
+        self.loader.start()
+
+    def finish_loading(self):
+        # place level objects now when all sprites are decoded
+        self.reset()
+        self.flow = FlowField(self.level)
+        self.minimap = Minimap(self.level)
+
+        # start background music
         pygame.mixer.music.set_volume(0.1)
         pygame.mixer.music.play(-1, 0.0)
 
-        # track player achievements
-        self.achievements = Achievements()
+    def reset(self):
+        # put level objects where the level file placed them, parsed level
+        # (its spawns and firing lanes), sprites and sounds are kept
+        self.bullets = []
+        self.cannons = []
+        self.hearts = []
+        self.medals = []
+        self.ships = []
+        self.ship_areas = collections.defaultdict(set)
+        self.rotating = set()
+        self.player_tile = None
+        self.particles.clear()
+        self.scheduler = Scheduler()
+        self.achievements = Achievements(self)
+
+        # load player ship configuration
+        self.player = Player(self)
+        self.level.spawn_entities()
+
+    def reload_level(self, old, new):
+        # put changes of the level file into the running game, returns
+        # number of changed tiles
+        cells = self.level.reload(old, new)
+        if cells is None:
+            # size or legend changed, objects are placed again everywhere
+            # but the player stays where it is
+            self.level.parse(new)
+            for ship in self.ships:
+                ship.sink()
+            for group in (self.cannons, self.hearts, self.medals, self.ships):
+                del group[:]
+            self.rotating.clear()
+            self.level.spawn_entities()
+            self.flow = FlowField(self.level)
+            self.minimap = Minimap(self.level)
+            return self.level.width * self.level.height
+        self.flow.refresh(self.level, cells)
+        self.minimap.refresh(self.level, cells)
+        return len(cells)
+
+    def place_ship(self, ship, old=None):
+        # keep ship index up to date, old is tile ship sailed from or None
+        # for new ships
+        if old is not None:
+            self.ship_areas[(old[0] // SHIP_AREA, old[1] // SHIP_AREA)].discard(ship)
+        self.ship_areas[(ship.x // SHIP_AREA, ship.y // SHIP_AREA)].add(ship)
+
+    def remove_ship(self, ship):
+        self.ship_areas[(ship.x // SHIP_AREA, ship.y // SHIP_AREA)].discard(ship)
+        self.rotating.discard(ship)
+
+    def ships_near(self, x, y):
+        (area_x, area_y) = (x // SHIP_AREA, y // SHIP_AREA)
+        ships = []
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                ships.extend(self.ship_areas.get((area_x + dx, area_y + dy), ()))
+        return ships
+
+    def restart(self):
+        # play again right away after the game is lost
+        self.reset()
+        self.flow.reset()
+        self.screen = 'gameplay'
+        pygame.mixer.music.set_volume(0.1)
 
     def tick(self):
         # Method used to calculate time elapsed (for animations)
-        self.clock_elapsed = game.clock.tick(50)
+        self.clock_elapsed = self.clock.tick(self.framerate)
+        self.frame_start = time.perf_counter()
         return self.clock_elapsed
 
+    def frame_deadline(self):
+        return self.frame_start + FRAME_TIME / 1000.0
+
+    def snapshot(self, presses=()):
+        # copy of what is needed to draw the game world as it is now
+        def group(entities):
+            return tuple((entity.x, entity.y, entity.image()) for entity in entities)
+
+        goals = []
+        for goal in self.achievements.goals:
+            if goal.reached:
+                status = goal.unlocked.format(goal.count)
+            else:
+                status = 'Target not reached'
+            goals.append((goal.icon, goal.title.format(goal.target), status, goal.reached))
+
+        return Snapshot(
+            water=self.water,
+            player=(self.player.x, self.player.y, self.player.image()),
+            alive=self.player.is_alive,
+            bullets=group(self.bullets),
+            particles=self.particles.snapshot(),
+            hearts=group(self.hearts),
+            medals=group(self.medals),
+            cannons=group(self.cannons),
+            ships=group(self.ships),
+            started=self.started,
+            screen=self.screen,
+            energy=self.player.energy,
+            score=self.player.score,
+            lost=self.player.has_lost(),
+            show_minimap=self.show_minimap,
+            goals=tuple(goals),
+            presses=tuple(presses),
+            level=self.level.view(),
+            minimap=self.minimap
+        )
+
+    def press(self, key):
+        if self.player.has_lost():
+            if key == pygame.K_SPACE:
+                self.restart()
+            return
+        if not self.player.is_alive:
+            return
+        if self.started:
+            if self.screen == 'gameplay':
+                if key == pygame.K_DOWN:
+                    self.player.down()
+                elif key == pygame.K_UP:
+                    self.player.up()
+                elif key == pygame.K_LEFT:
+                    self.player.left()
+                elif key == pygame.K_RIGHT:
+                    self.player.right()
+                elif key == pygame.K_SPACE:
+                    self.player.fire()
+                elif key == pygame.K_a:
+                    self.screen = 'achievements'
+                elif key == pygame.K_m:
+                    self.show_minimap = not self.show_minimap
+            elif self.screen == 'achievements':
+                if key == pygame.K_SPACE:
+                    self.screen = 'gameplay'
+        else:
+            if key == pygame.K_SPACE:
+                self.started = True
+
+    def update(self, elapsed):
+        # move game world one step forward, elapsed is time (in miliseconds)
+        # the step stands for
+
+        # pick up changes of the level file in development mode
+        if self.watcher is not None:
+            self.watcher.check(elapsed)
+
+        # game world is paused while achievements are shown
+        if self.screen == 'gameplay':
+            self.scheduler.advance(elapsed)
+            self.particles.update(elapsed)
+
+            # debris all over the screen for measuring
+            if len(self.particles) < self.stress_particles:
+                for i in range(0, (self.stress_particles - len(self.particles)) // 20 + 1):
+                    self.particles.debris(self.player.x + random.uniform(-14, 14),
+                                          self.player.y + random.uniform(-11, 11), 20)
+
+        # water animation
+        if not self.reduced_effects:
+            self.water += 2
+            if self.water == TILE_WIDTH: self.water = 0
+
+        self.player.move()
+
+        # update sea routes ships use to find the player
+        if self.screen == 'gameplay':
+            self.flow.update(self.player.x, self.player.y)
+
+        # move bullets and see if somebody hit somebody
+        for bullet in list(self.bullets):
+            bullet.move()
+            if not bullet.finished():
+                continue
+
+            missed = True
+            if bullet.reaches(self.player):
+                missed = False
+                self.player.energy -= 1
+                if self.player.energy <= 0:
+                    self.player.dead()
+                self.particles.explosion(bullet.x, bullet.y, 'medium')
+                self.assets.play('explosion', 0.6)
+            else:
+                # check to see if any bullet reaches enemy ship
+                for ship in self.ships:
+                    if bullet.reaches(ship):
+                        self.player.add_score(250)
+                        missed = False
+                        self.ships.remove(ship)
+                        ship.sink()
+                        self.particles.explosion(bullet.x, bullet.y, 'small')
+
+                        # play explosion sound
+                        self.assets.play('explosion', 0.5)
+
+                        break # same bullet can't hit few items
+
+                # check to see if any bullet reaches cannons
+                for cannon in self.cannons:
+                    if bullet.reaches(cannon):
+                        self.player.add_score(100)
+                        missed = False
+                        self.cannons.remove(cannon)
+                        self.level.remove_cannon(cannon)
+                        self.particles.explosion(bullet.x, bullet.y, 'small')
+
+                        # check player achievements
+                        self.achievements.notify('cannon killed')
+
+                        # play explosion sound
+                        self.assets.play('explosion', 0.5)
+
+                        break # same bullet can't hit few items
+            if missed:
+                self.particles.explosion(bullet.x, bullet.y, 'tiny')
+                self.assets.play('explosion', 0.05)
+            self.bullets.remove(bullet)
+
+        # special items - hearts
+        for heart in list(self.hearts):
+            if heart.reaches(self.player):
+                # play healt song
+                self.assets.play('healt', 0.2)
+
+                self.player.add_score(50)
+
+                # add health to the user
+                if self.player.energy < self.player.max_energy:
+                    self.player.energy += 1
+
+                # drop collected item
+                self.hearts.remove(heart)
+
+        # special items - medals
+        for mini_medal in list(self.medals):
+            if mini_medal.reaches(self.player):
+                # play healt song
+                self.assets.play('medal', 0.2)
+
+                self.player.add_score(500)
+
+                # drop collected item
+                self.medals.remove(mini_medal)
+
+        if self.screen == 'gameplay':
+            # only cannons which have player in their firing lanes react to it
+            for (cannon, direction) in self.level.cannons_at(self.player.x, self.player.y):
+                cannon.engage(direction)
+
+            # ships near the player look for it once it enters another tile
+            if (self.player.x, self.player.y) != self.player_tile:
+                self.player_tile = (self.player.x, self.player.y)
+                for ship in self.ships_near(self.player.x, self.player.y):
+                    ship.aim()
+
+            for entity in list(self.rotating):
+                entity.move()
+
+        if self.player.has_lost():
+            # lower the sound to make everything more sad to the player
+            if pygame.mixer.music.get_volume() >= 0.1:
+                pygame.mixer.music.set_volume(pygame.mixer.music.get_volume() - 0.02)
+        elif self.started:
+            # add some background music volume when game has started
+            if pygame.mixer.music.get_volume() < 0.4:
+                pygame.mixer.music.set_volume(pygame.mixer.music.get_volume() + 0.01)
+
 
 class Heart(object):
     def __init__(self, game, x, y):
         self.game = game
         self.x = x
         self.y = y
-        self.sprite = pygame.transform.scale(pygame.image.load('./data/sprites/heart.png').convert_alpha(), (TILE_WIDTH, TILE_HEIGHT))
+        self.sprite = game.assets.image('heart', (TILE_WIDTH, TILE_HEIGHT))
 
     def image(self):
         return self.sprite
@@ -89,7 +1140,7 @@ class Heart(object):
 class Medal(Heart):
     def __init__(self, game, x, y):
         Heart.__init__(self, game, x, y)
-        self.sprite = pygame.transform.scale(pygame.image.load('./data/sprites/medal.png').convert_alpha(), (TILE_WIDTH, TILE_HEIGHT))
+        self.sprite = game.assets.image('medal', (TILE_WIDTH, TILE_HEIGHT))
 
 
 class Cannon(object):
@@ -107,7 +1158,7 @@ class Cannon(object):
             'up': 90,
             'down': 270
         }
-        self.down_image = pygame.image.load('./data/sprites/cannon.png').convert_alpha()
+        self.down_image = game.assets.image('cannon')
         self.sprites = {
             'left': pygame.transform.rotate(self.down_image, self.angles['left']),
             'right': pygame.transform.rotate(self.down_image, self.angles['right']),
@@ -118,9 +1169,13 @@ class Cannon(object):
         self.rotate_to = None
         self.current_angle = self.angles[self.position]
 
-        self.fire_timer = 0
+        # cannon can fire again once it's reloaded
+        self.loaded = True
         self.fire_frequency = 2000 # in miliseconds
 
+    def reload(self):
+        self.loaded = True
+
     def distance_from_player(self):
         return math.sqrt((self.x - self.game.player.x) ** 2 + (self.y - self.game.player.y)**2)
 
@@ -133,16 +1188,6 @@ class Cannon(object):
         if not self.game.player.is_alive:
             return False
 
-        # no need to fire if player is behind
-        if self.position == 'down' and self.y > self.game.player.y:
-            return False
-        elif self.position == 'up' and self.y < self.game.player.y:
-            return False
-        elif self.position == 'right' and self.x > self.game.player.x:
-            return False
-        elif self.position == 'left' and self.x < self.game.player.x:
-            return False
-
         # calculate distance between player and canon - if it's close enough - fire
         return self.distance_from_player() < self.max_distance + 2
 
@@ -152,44 +1197,36 @@ class Cannon(object):
     def image(self):
         return self.sprite
 
-    def move(self):
-        if self.fire_timer > 0:
-            self.fire_timer -= self.game.clock_elapsed
+    def engage(self, direction):
+        # called when player is in one of cannon firing lanes
+        if self.rotate_to is not None:
+            return
+
+        if direction == self.position:
+            if self.should_fire() and self.loaded:
+                self.loaded = False
+                self.game.scheduler.schedule(self.fire_frequency, self.reload)
+                self.game.bullets.append(Bullet(self.game, self.x, self.y, self.position, int(self.distance_from_player()) - 1))
+        elif self.is_close_enough():
+            # follow player ship and switch position
+            self.position = direction
+            self.rotate_to = self.angles[self.position]
+            self.game.rotating.add(self)
+            if self.rotate_to == 270 and self.current_angle == 0:
+                self.current_angle = 360
+            elif self.rotate_to == 0 and self.current_angle == 270:
+                self.current_angle = -90
 
+    def move(self):
         if self.rotate_to is not None:
             if self.rotate_to > self.current_angle:
                 self.current_angle += 10
             elif self.rotate_to < self.current_angle:
                 self.current_angle -= 10
-            self.sprite = pygame.transform.rotate(pygame.image.load('./data/sprites/cannon.png').convert_alpha(), self.current_angle)
+            self.sprite = pygame.transform.rotate(self.down_image, self.current_angle)
             if self.current_angle == self.rotate_to:
                 self.rotate_to = None
-        else:
-            if self.should_fire() and self.fire_timer <= 0:
-                self.fire_timer = self.fire_frequency
-                self.game.bullets.append(Bullet(self.x, self.y, self.position, int(self.distance_from_player()) - 1))
-            elif self.is_close_enough():
-                # follow player ship and switch position if needed
-                if abs(self.y - self.game.player.y) < 2:
-                    if self.x > self.game.player.x:
-                        self.position = 'left'
-                    else:
-                        self.position = 'right'
-                    self.rotate_to = self.angles[self.position]
-                    if self.rotate_to == 270 and self.current_angle == 0:
-                        self.current_angle = 360
-                    elif self.rotate_to == 0 and self.current_angle == 270:
-                        self.current_angle = -90
-                elif abs(self.x - self.game.player.x) < 2:
-                    if self.y > self.game.player.y:
-                        self.position = 'up'
-                    else:
-                        self.position = 'down'
-                    self.rotate_to = self.angles[self.position]
-                    if self.rotate_to == 270 and self.current_angle == 0:
-                        self.current_angle = 360
-                    elif self.rotate_to == 0 and self.current_angle == 270:
-                        self.current_angle = -90
+                self.game.rotating.discard(self)
 
 
 class Ship(object):
@@ -207,19 +1244,98 @@ class Ship(object):
             'up': 180,
             'down': 0
         }
-        self.down_image = pygame.transform.scale(pygame.image.load('./data/sprites/ship.png').convert_alpha(), (int(TILE_WIDTH * 2.5), int(TILE_HEIGHT * 2.5)))
+        self.down_image = game.assets.image('ship', (int(TILE_WIDTH * 2.5), int(TILE_HEIGHT * 2.5)))
         self.sprite = pygame.transform.rotate(self.down_image, self.angles[self.position])
         self.rotate_to = None
         self.current_angle = self.angles[self.position]
 
-        self.fire_timer = 0
+        self.loaded = True
         self.fire_frequency = 3000 # in miliseconds
+        self.reload_event = None
 
         # ship traveling settings
         self.travel_left = 1
         self.travel_routine = 3
-        self.travel_timer = 0
         self.travel_frequency = 2000 # in miliseconds
+        self.travel_event = game.scheduler.schedule(0, self.travel)
+        game.place_ship(self)
+
+    def reload(self):
+        self.reload_event = None
+        self.loaded = True
+        self.aim()
+
+    def travel(self):
+        self.travel_event = None
+        direction = self.steer()
+        if direction is not None:
+            self.travel_left = self.travel_routine
+            if direction != self.position:
+                self.turn(direction)
+        else:
+            self.travel_left -= 1
+            if self.travel_left == 0:
+                self.travel_left = self.travel_routine
+
+                # change position around clock
+                if self.position == 'up': self.turn('right')
+                elif self.position == 'down': self.turn('left')
+                elif self.position == 'left': self.turn('up')
+                else: self.turn('down')
+
+        # move based on current position
+        old = (self.x, self.y)
+        if self.position == 'up': self.y -= 1
+        elif self.position == 'down': self.y += 1
+        elif self.position == 'left': self.x -= 1
+        else: self.x += 1
+        self.game.place_ship(self, old)
+
+        # ship does not travel while turning, next trip is planned once
+        # rotation is finished
+        if self.rotate_to is None:
+            self.travel_event = self.game.scheduler.schedule(self.travel_frequency, self.travel)
+            self.aim()
+
+    def turn(self, position):
+        self.position = position
+        self.rotate_to = self.angles[self.position]
+        self.game.rotating.add(self)
+
+        # rotate the short way round
+        while self.rotate_to - self.current_angle > 180:
+            self.current_angle += 360
+        while self.current_angle - self.rotate_to > 180:
+            self.current_angle -= 360
+
+    def steer(self):
+        # ships patrol until the game starts or player is out of reach
+        if not self.game.started or not self.game.player.is_alive:
+            return None
+
+        # sail towards the player, when close enough circle around it
+        flow = self.game.flow
+        distance = flow.distance(self.x, self.y)
+        if distance <= 0:
+            return None
+        toward = flow.toward(self.x, self.y)
+        if distance > FLANK_DISTANCE:
+            return toward
+
+        sides = FLANKS[toward]
+        if self.position == sides[1]:
+            sides = sides[::-1]
+        for side in sides:
+            (dx, dy) = DIRECTIONS[side]
+            if flow.is_open(self.x + dx, self.y + dy):
+                return side
+        return toward
+
+    def sink(self):
+        # sunk ship neither sails nor reloads and fires again
+        self.game.scheduler.cancel(self.travel_event)
+        self.game.scheduler.cancel(self.reload_event)
+        self.game.remove_ship(self)
 
     def distance_from_player(self):
         return math.sqrt((self.x - self.game.player.x) ** 2 + (self.y - self.game.player.y)**2)
@@ -249,106 +1365,190 @@ class Ship(object):
     def image(self):
         return self.sprite
 
-    def move(self):
-        if self.rotate_to is None:
-            if self.fire_timer > 0:
-                self.fire_timer -= self.game.clock_elapsed
-            if self.travel_timer > 0:
-                self.travel_timer -= self.game.clock_elapsed
-            else:
-                self.travel_timer = self.travel_frequency
-                self.travel_left -= 1
-                if self.travel_left == 0:
-                    self.travel_left = self.travel_routine
-
-                    # change position around clock
-                    if self.position == 'up': self.position = 'right'
-                    elif self.position == 'down': self.position = 'left'
-                    elif self.position == 'left': self.position = 'up'
-                    else: self.position = 'down'
-                    self.rotate_to = self.angles[self.position]
-                    if self.rotate_to == 270 and self.current_angle == 0:
-                        self.current_angle = 360
-
-                # move based on current position
-                if self.position == 'up': self.y -= 1
-                elif self.position == 'down': self.y += 1
-                elif self.position == 'left': self.x -= 1
-                else: self.x += 1
-
-            if self.should_fire() and self.fire_timer <= 0:
-                self.fire_timer = self.fire_frequency
-                self.game.bullets.append(Bullet(self.x, self.y, self.position, int(self.distance_from_player()) - 1))
-        else:
-            if self.rotate_to > self.current_angle:
-                self.current_angle += 15
-            elif self.rotate_to < self.current_angle:
-                self.current_angle -= 15
-            self.sprite = pygame.transform.rotate(self.down_image, self.current_angle)
-            if self.current_angle == self.rotate_to:
-                self.rotate_to = None
+    def aim(self):
+        # called when ship or player moved or ship got reloaded, ship does
+        # not fire while turning
+        if self.rotate_to is None and self.loaded and self.should_fire():
+            self.loaded = False
+            self.reload_event = self.game.scheduler.schedule(self.fire_frequency, self.reload)
+            self.game.bullets.append(Bullet(self.game, self.x, self.y, self.position, int(self.distance_from_player()) - 1))
 
-
-class Explosion(object):
-    def __init__(self, game, x, y, size):
+    def move(self):
+        # one step of turning round, see Game.rotating
+        if self.rotate_to > self.current_angle:
+            self.current_angle += 15
+        elif self.rotate_to < self.current_angle:
+            self.current_angle -= 15
+        self.sprite = pygame.transform.rotate(self.down_image, self.current_angle)
+        if self.current_angle == self.rotate_to:
+            self.rotate_to = None
+            self.game.rotating.discard(self)
+            self.travel_event = self.game.scheduler.schedule(self.travel_frequency, self.travel)
+            self.aim()
+
+
+class Particles(object):
+    # every short lived effect (explosions and flying debris) is a
+    # batch of particles emitted together: they share birth, death,
+    # origin and animation, only their velocities are kept per particle,
+    # in columns shared by many batches; whole batches are dropped and
+    # culled at once and positions come from columns worked out once and
+    # cached, instead of calling an object per particle
+    def __init__(self, game):
         self.game = game
-        self.x = x
-        self.y = y
-        self.frame_no = -1
-        self.frame_frequency = 50 # in miliseconds
-        self.frame_time = 0
-
-        # explosion size is based on exploded object size
-        if size == 'tiny':
-            self.size = (TILE_WIDTH, TILE_HEIGHT)
-        elif size == 'small':
-            self.size = (TILE_WIDTH * 2, TILE_HEIGHT * 2)
-        elif size == 'medium':
-            self.size = (TILE_WIDTH * 3, TILE_HEIGHT * 3)
-
-        # set and scale animation frames
-        self.frames = [
-            pygame.transform.scale(pygame.image.load('./data/sprites/explosion3.png').convert_alpha(), self.size),
-            pygame.transform.scale(pygame.image.load('./data/sprites/explosion2.png').convert_alpha(), self.size),
-            pygame.transform.scale(pygame.image.load('./data/sprites/explosion1.png').convert_alpha(), self.size),
-        ]
-
-    def image(self):
-        if self.frame_time > 0:
-            self.frame_time -= self.game.clock_elapsed
-        else:
-            self.frame_time = self.frame_frequency
-            self.frame_no += 1
 
-        return self.frames[self.frame_no]
-
-    def finished(self):
-        return self.frame_no == len(self.frames) - 1
+        # particle time in miliseconds, stopped while the game is paused
+        self.now = 0
+
+        # batches of [born, dies, first sprite, number of sprites, x, y,
+        # reach, velocities, last snapshot]; position (in pixels of the
+        # level) at any time follows from origin and velocity, so moving
+        # particles needs no work until they are drawn
+        self.batches = []
+        self.count = 0
+
+        # (count, speed) -> velocities shared by batches emitted with them,
+        # each is [dx column, dy column, travel -> offset columns]
+        self.velocities = {}
+
+        # sprites of all animations and where each animation starts,
+        # animation frames are shown one after another over particle life
+        self.sprites = []
+        self.offsets = []
+        self.animations = {}
+
+        # nothing has to be dropped until this time
+        self.next_death = float('inf')
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        self.batches = []
+        self.count = 0
+        self.next_death = float('inf')
+
+    def animation(self, frames):
+        # frames are (sprite name, size) pairs, their images are looked up
+        # once and shared by all particles using the animation
+        frames = tuple(frames)
+        if frames not in self.animations:
+            self.animations[frames] = len(self.sprites)
+            for (name, size) in frames:
+                sprite = self.game.assets.image(name, size)
+                self.sprites.append(sprite)
+                self.offsets.append(self.game.render_queue.offset(sprite))
+        return (self.animations[frames], len(frames))
+
+    def velocity(self, count, speed):
+        # count random directions at up to speed tiles per milisecond (in
+        # pixels per milisecond); a few sets are made for each count and
+        # speed and picked at random, so their offsets can be shared
+        shared = self.velocities.setdefault((count, speed), [])
+        if len(shared) >= PARTICLE_VELOCITIES:
+            return random.choice(shared)
+        (dx, dy) = ([], [])
+        for i in range(0, count):
+            angle = random.uniform(0, math.pi * 2)
+            velocity = random.uniform(speed / 2, speed)
+            dx.append(math.cos(angle) * velocity * TILE_WIDTH)
+            dy.append(math.sin(angle) * velocity * TILE_HEIGHT)
+        shared.append([dx, dy, {}])
+        return shared[-1]
+
+    def emit(self, frames, x, y, life, count=1, speed=0.0):
+        # count particles flying from tile x, y in random directions at up
+        # to speed tiles per milisecond, for life miliseconds
+        (first, length) = self.animation(frames)
+
+        # particles slow down and stop at the end of their life, half way
+        # from where they would get at full speed
+        reach = speed * life / 2 * max(TILE_WIDTH, TILE_HEIGHT)
+        self.batches.append([self.now, self.now + life, first, length,
+                             x * TILE_WIDTH, y * TILE_HEIGHT, reach, self.velocity(count, speed), None])
+        self.count += count
+        self.next_death = min(self.next_death, self.now + life)
+
+    def explosion(self, x, y, size):
+        # blast where a bullet landed
+        size = {'tiny': 1, 'small': 2, 'medium': 3}[size]
+        blast = [(name, (TILE_WIDTH * size, TILE_HEIGHT * size)) for name in ('explosion3', 'explosion2')]
+
+        # overloaded game shows only the first frame
+        if self.game.reduced_effects:
+            self.emit(blast[:1], x, y, 50)
+            return
+        self.emit(blast, x, y, 100)
+
+    def debris(self, x, y, count):
+        frames = [('explosion1', (16, 16)), ('explosion3', (16, 16)), ('explosion3', (8, 8))]
+        self.emit(frames, x, y, random.randint(300, 500), count, 0.006)
+
+    def update(self, elapsed):
+        self.now += elapsed
+        if self.now < self.next_death:
+            return
+
+        # drop finished batches
+        self.batches = [batch for batch in self.batches if batch[1] > self.now]
+        self.count = sum(len(batch[7][0]) for batch in self.batches)
+        self.next_death = min([batch[1] for batch in self.batches] or [float('inf')])
+
+    def snapshot(self):
+        # sprites and tuple of (sprite, x, y, reach, left, top, x column,
+        # y column) of each batch as it is now, columns hold offsets of
+        # the particles from left, top corner of the sprite at origin; the
+        # drawing thread can use them while particles move on
+        batches = []
+        now = self.now
+        for batch in self.batches:
+            (born, dies, first, frames, x, y, reach, velocity, drawn) = batch
+            age = now - born
+            if drawn is None or drawn[0] != age:
+                # sprite and travelled distance are the same for all
+                # particles of the batch; travel is rounded to whole
+                # miliseconds at full speed (under a pixel), so columns of
+                # each distance are worked out once for all batches
+                # sharing the velocities
+                life = dies - born
+                travel = int(age * (1 - age / (2 * life)))
+                columns = velocity[2].get(travel)
+                if columns is None:
+                    columns = velocity[2][travel] = ([round(n * travel) for n in velocity[0]],
+                                                     [round(n * travel) for n in velocity[1]])
+                sprite = first + int(frames * age / life)
+                (left, top) = (x + self.offsets[sprite][0], y + self.offsets[sprite][1])
+                drawn = batch[8] = (age, (sprite, x, y, reach, left, top) + columns)
+            batches.append(drawn[1])
+        return (tuple(self.sprites), tuple(batches))
 
 
 class Bullet(object):
-    def __init__(self, x, y, position, max_distance):
+    def __init__(self, game, x, y, position, max_distance):
+        self.game = game
         self.start_x = x
         self.start_y = y
         self.x = x
         self.y = y
         self.max_distance = max_distance
         self.position = position
-        self.sprite = pygame.image.load('./data/sprites/bullet.png').convert_alpha()
+        self.sprite = game.assets.image('bullet')
         self.increase_size = 5
         self.increase_step = 3
 
     def image(self):
-        # make bullet animation - in the middle of distance bullet should be bigger
-        if self.percents_traveled() < 50:
-            self.increase_size += self.increase_step
-        else:
-            self.increase_size -= self.increase_step
+        # overloaded game does not scale bullets every frame
+        if self.game.reduced_effects:
+            return self.game.assets.image('bullet', (int(TILE_WIDTH * 2.5), int(TILE_HEIGHT * 2.5)))
 
         size = (int(TILE_WIDTH * 2.5) + int(self.increase_size), int(TILE_HEIGHT * 2.5) + int(self.increase_size))
-        return pygame.transform.scale(pygame.image.load('./data/sprites/bullet.png').convert_alpha(), size)
+        return pygame.transform.scale(self.sprite, size)
 
     def percents_traveled(self):
+        # enemies right next to the player fire bullets with no distance
+        if self.max_distance <= 0:
+            return 100
+
         if self.position == 'up' or self.position == 'down':
             current_distance = abs(self.start_y - self.y)
             return int(current_distance * 100 / self.max_distance)
@@ -361,6 +1561,12 @@ class Bullet(object):
         return abs(self.start_x - self.x) > self.max_distance or abs(self.start_y - self.y) > self.max_distance
 
     def move(self):
+        # make bullet animation - in the middle of distance bullet should be bigger
+        if self.percents_traveled() < 50:
+            self.increase_size += self.increase_step
+        else:
+            self.increase_size -= self.increase_step
+
         if self.position == 'up': self.y -= 0.6
         if self.position == 'down': self.y += 0.6
         if self.position == 'right': self.x += 0.6
@@ -378,14 +1584,12 @@ class Player(object):
         self.position = 'down'
         self.energy = 5
         self.max_energy = 7
-        self.down_image = image = pygame.transform.scale(
-                pygame.image.load('./data/sprites/player.png').convert_alpha(),
-                (TILE_WIDTH * 2, TILE_HEIGHT * 2))
-        self.fire_timer = 0
+        self.down_image = game.assets.image('player', (TILE_WIDTH * 2, TILE_HEIGHT * 2))
+        self.loaded = True
         self.fire_frequency = 1000 # in miliseconds
         self.is_alive = True
         self.fire_distance = 8
-        self.dead_timer = 0
+        self.lost = False
         self.dead_delay = 2000 # in miliseconds
         self.score = 0
         self.initialized = False
@@ -409,12 +1613,7 @@ class Player(object):
         return self.sprite
 
     def move(self):
-        if self.rotate_to is None:
-            if self.fire_timer > 0:
-                self.fire_timer -= self.game.clock_elapsed
-            if self.dead_timer > 0:
-                self.dead_timer -= self.game.clock_elapsed
-        else:
+        if self.rotate_to is not None:
             # rotate ship till correct position
             if self.rotate_to > self.current_angle:
                 self.current_angle += 15
@@ -438,7 +1637,7 @@ class Player(object):
         if self.position == 'down': return False
         if self.rotate_to is not None: return False
 
-        self.game.achievements.distance_traveled += 1
+        self.game.achievements.notify('tile moved')
 
         if self.game.level.get_tile(self.x, self.y - 1)['name'] != 'sand' and self.game.level.get_tile(self.x, self.y - 2)['name'] != 'sand':
             self.y -= 1
@@ -453,7 +1652,7 @@ class Player(object):
         if self.position == 'up': return False
         if self.rotate_to is not None: return False
 
-        self.game.achievements.distance_traveled += 1
+        self.game.achievements.notify('tile moved')
 
         if self.game.level.get_tile(self.x, self.y + 1)['name'] != 'sand' and self.game.level.get_tile(self.x, self.y + 2)['name'] != 'sand':
             self.y += 1
@@ -470,7 +1669,7 @@ class Player(object):
         if self.position == 'right': return False
         if self.rotate_to is not None: return False
 
-        self.game.achievements.distance_traveled += 1
+        self.game.achievements.notify('tile moved')
 
         if self.game.level.get_tile(self.x - 1, self.y)['name'] != 'sand' and self.game.level.get_tile(self.x - 2, self.y)['name'] != 'sand':
             if self.position == 'left':
@@ -489,7 +1688,7 @@ class Player(object):
         if self.position == 'left': return False
         if self.rotate_to is not None: return False
 
-        self.game.achievements.distance_traveled += 1
+        self.game.achievements.notify('tile moved')
 
         if self.game.level.get_tile(self.x + 1, self.y)['name'] != 'sand' and self.game.level.get_tile(self.x + 2, self.y)['name'] != 'sand':
             self.x += 1
@@ -500,17 +1699,28 @@ class Player(object):
         else:
             return False
 
+    def add_score(self, points):
+        self.score += points
+        self.game.achievements.notify('score changed', self.score)
+
+    def reload(self):
+        self.loaded = True
+
     def fire(self):
-        if self.fire_timer <= 0:
-            self.game.bullets.append(Bullet(self.x, self.y, self.position, self.fire_distance))
-            self.fire_timer = self.fire_frequency
+        if self.loaded:
+            self.game.bullets.append(Bullet(self.game, self.x, self.y, self.position, self.fire_distance))
+            self.loaded = False
+            self.game.scheduler.schedule(self.fire_frequency, self.reload)
 
     def dead(self):
         self.is_alive = False
-        self.dead_timer = self.dead_delay
+        self.game.scheduler.schedule(self.dead_delay, self.lose)
+
+    def lose(self):
+        self.lost = True
 
     def has_lost(self):
-        return not self.is_alive and self.dead_timer < 0
+        return not self.is_alive and self.lost
 
 
 class Camera(object):
@@ -522,13 +1732,31 @@ class Level(object):
     def __init__(self, game):
         self.game = game
 
-    def load_file(self, filename):
+    def parse_file(self, filename):
+        # only reads the map so it can run on loader thread - objects found
+        # in the map are placed by spawn_entities() afterwards
+        with open(filename, 'rb') as f:
+            content = f.read()
+
+        # precompiled level is used only when it was made from the same map
+        # and sprites, otherwise it is parsed from scratch
+        if self.load_compiled(filename + 'c', self.digest(content)):
+            return
+        self.parse(content)
+
+    def parse(self, content):
         self.map = []
-        self.images = {}
+        self.spawns = []
+
+        # cannons which can shoot at a tile: (x, y) -> [(cannon x, cannon y, direction)]
+        self.lanes = {}
+
+        # complex tiles with no sprite for their neighbours: (x, y, name, hashed)
+        self.missing = []
 
         # read level appearance
         parser = configparser.ConfigParser()
-        parser.read(filename)
+        parser.read_string(content.decode('utf-8'))
         area = parser.get("level", "map").split("\n")
 
         # read all available objects configurations
@@ -573,77 +1801,312 @@ class Level(object):
         # normalize map
         for x in range(0, self.width):
             for y in range(0, self.height):
-                if self.get_real_tile(x, y)['complex'] == 'no': continue
-
-                tile = self.get_real_tile(x, y)
-                if tile['name'] == 'cannon':
-                    # fint closest water source so we know where cannon is pointing at
-                    position = None
-                    if self.get_tile(x - 3, y)['name'] == 'water': position = 'left'
-                    if self.get_tile(x + 3, y)['name'] == 'water': position = 'right'
-                    if self.get_tile(x, y - 3)['name'] == 'water': position = 'up'
-                    if self.get_tile(x, y + 3)['name'] == 'water': position = 'down'
-                    self.game.cannons.append(Cannon(self.game, x, y, position))
-
-                    # replace cannon in the map with water
-                    self.map[y][x] = self.keys[tile['act_as']]
-                    self.map[y][x]['image'] = self.keys[tile['act_as']]['name']
-                    continue
-                elif tile['name'] == 'player':
-                    # set player coordinates from the map
-                    if not self.game.player.initialized:
-                        self.game.player.set_position(x, y)
-
-                    # replace player place in the map with the water
-                    self.map[y][x] = self.keys['.']
-                    self.map[y][x]['image'] = 'water'
-                elif tile['name'] == 'heart':
-                    # add heart to the map
-                    self.game.hearts.append(Heart(self.game, x, y))
-
-                    # replace player place in the map with the water
-                    self.map[y][x] = self.keys['.']
-                    self.map[y][x]['image'] = 'water'
-                elif tile['name'] == 'medal':
-                    # add medal to the map
-                    self.game.medals.append(Medal(self.game, x, y))
-
-                    # replace player place in the map with the water
-                    self.map[y][x] = self.keys['.']
-                    self.map[y][x]['image'] = 'water'
-                elif tile['name'] == 'ship':
-                    # add medal to the map
-                    self.game.ships.append(Ship(self.game, x, y, random.choice(['up', 'down', 'right', 'left'])))
-
-                    # replace player place in the map with the water
-                    self.map[y][x] = self.keys['.']
-                    self.map[y][x]['image'] = 'water'
-
-                name = self.get_tile(x, y)['name']
-                left = self.get_tile(x - 1, y)['name']
-                right = self.get_tile(x + 1, y)['name']
-                top = self.get_tile(x, y - 1)['name']
-                bottom = self.get_tile(x, y + 1)['name']
-
-                hashed = left[0] + right[0] + top[0] + bottom[0]
-
-                # choose sand sprite based on sand/land position
-                if os.path.isfile('./data/sprites/{}-{}.png'.format(name, hashed)):
-                    self.map[y][x]['image'] = '{}-{}'.format(name, hashed)
-                else:
-                    self.map[y][x]['image'] = 'water' # so we can spot missing sprite in the game
+                self.place(x, y)
+                self.autotile(x, y)
+
+        # precompute where each cannon can shoot and point it to the water
+        for (i, (name, x, y, position)) in enumerate(self.spawns):
+            if name == 'cannon':
+                self.spawns[i] = (name, x, y, self.build_lanes(x, y))
+
+    def place(self, x, y):
+        # objects found in the map are spawned later, their place in the map
+        # is taken by the tile they act as
+        tile = self.get_real_tile(x, y)
+        if tile['complex'] == 'no': return
+
+        if tile['name'] == 'cannon':
+            # direction is chosen once all lanes are known
+            self.spawns.append(('cannon', x, y, None))
+
+            # replace cannon in the map with water
+            self.map[y][x] = self.keys[tile['act_as']]
+            self.map[y][x]['image'] = self.keys[tile['act_as']]['name']
+        elif tile['name'] in ('player', 'heart', 'medal', 'ship'):
+            # set player, item or ship coordinates from the map
+            self.spawns.append((tile['name'], x, y, None))
+
+            # replace their place in the map with the water
+            self.map[y][x] = self.keys['.']
+            self.map[y][x]['image'] = 'water'
+
+    def autotile(self, x, y):
+        if self.get_real_tile(x, y)['complex'] == 'no': return
+
+        name = self.get_tile(x, y)['name']
+        left = self.get_tile(x - 1, y)['name']
+        right = self.get_tile(x + 1, y)['name']
+        top = self.get_tile(x, y - 1)['name']
+        bottom = self.get_tile(x, y + 1)['name']
+
+        hashed = left[0] + right[0] + top[0] + bottom[0]
+
+        # choose sand sprite based on sand/land position
+        if data.exists('sprites/{}-{}.png'.format(name, hashed)):
+            image = '{}-{}'.format(name, hashed)
+        else:
+            image = 'water' # so we can spot missing sprite in the game
+            self.missing.append((x, y, name, hashed))
+
+        # tile is replaced, not changed, as cells of precompiled level share
+        # their tiles
+        if self.map[y][x]['image'] != image:
+            self.map[y][x] = dict(self.map[y][x], image=image)
+
+    def reload(self, old, new):
+        # apply changes between two versions of the map file to the running
+        # level; only changed tiles and their neighbours get new sprites and
+        # only objects standing on changed tiles are placed again. Returns
+        # changed tiles or None if the map can't be changed in place.
+        (old_area, old_legend) = self.read_area(old)
+        (area, legend) = self.read_area(new)
+        if legend != old_legend or len(area) != len(old_area):
+            return None
+        width = len(old_area[0])
+        if any(len(row) != width for row in area + old_area):
+            return None
+
+        # map is followed by the same map turned upside down
+        cells = {}
+        for y in range(0, len(area)):
+            if area[y] == old_area[y]:
+                continue
+            for x in range(0, width):
+                if area[y][x] != old_area[y][x]:
+                    if area[y][x] not in self.keys:
+                        raise KeyError(area[y][x])
+                    cells[(x, y)] = area[y][x]
+                    cells[(self.width - 1 - x, self.height - 1 - y)] = area[y][x]
+        if not cells:
+            return []
+
+        # objects on changed tiles are removed, everything else is kept
+        removed = [(x, y) for (name, x, y, position) in self.spawns if name == 'cannon' and (x, y) in cells]
+        self.spawns = [spawn for spawn in self.spawns if (spawn[1], spawn[2]) not in cells]
+        for group in (self.game.hearts, self.game.medals, self.game.ships, self.game.cannons):
+            for entity in list(group):
+                if (entity.x, entity.y) in cells:
+                    group.remove(entity)
+                    if group is self.game.ships:
+                        entity.sink()
+                    elif group is self.game.cannons:
+                        self.remove_cannon(entity)
+        self.missing = [tile for tile in self.missing if (tile[0], tile[1]) not in cells]
+
+        # changed rows (and rows around them) are replaced, not changed, so
+        # views of the level taken before stay as they were
+        self.map = list(self.map)
+        for y in set(y + dy for (x, y) in cells for dy in (-1, 0, 1)):
+            if 0 <= y < self.height:
+                self.map[y] = list(self.map[y])
+        self.original_map = self.map
 
-    def get_sprite(self, name):
-        # try to get image from cache
-        if name in self.images:
-            return self.images[name]
+        first = len(self.spawns)
+        for ((x, y), char) in cells.items():
+            meta = dict(self.keys[char])
+            meta['image'] = meta['name']
+            self.map[y][x] = meta
+        for (x, y) in cells:
+            self.place(x, y)
+
+        # sprites of neighbours depend on the changed tiles too
+        around = set()
+        for (x, y) in cells:
+            for (dx, dy) in ((0, 0), (-1, 0), (1, 0), (0, -1), (0, 1)):
+                if 0 <= x + dx < self.width and 0 <= y + dy < self.height:
+                    around.add((x + dx, y + dy))
+        self.missing = [tile for tile in self.missing if (tile[0], tile[1]) not in around]
+        for (x, y) in around:
+            self.autotile(x, y)
+
+        # firing lanes of cannons close to changed tiles are built again,
+        # cannons keep the direction they are facing
+        reach = CANNON_RANGE + 1
+        buckets = set((x // reach, y // reach) for (x, y) in cells)
+        rebuilt = []
+        for (i, (name, x, y, position)) in enumerate(self.spawns):
+            if name != 'cannon':
+                continue
+            (column, row) = (x // reach, y // reach)
+            if any((column + dx, row + dy) in buckets for dx in (-1, 0, 1) for dy in (-1, 0, 1)):
+                rebuilt.append(i)
+        for (x, y) in removed + [self.spawns[i][1:3] for i in rebuilt]:
+            for (dx, dy) in DIRECTIONS.values():
+                for distance in range(1, CANNON_RANGE + 1):
+                    for side in (-1, 0, 1):
+                        tile = (x + dx * distance + side * abs(dy), y + dy * distance + side * abs(dx))
+                        if tile in self.lanes:
+                            self.lanes[tile] = [lane for lane in self.lanes[tile] if lane[:2] != (x, y)]
+        for i in rebuilt:
+            (name, x, y, position) = self.spawns[i]
+            self.spawns[i] = (name, x, y, self.build_lanes(x, y))
+
+        for (name, x, y, position) in self.spawns[first:]:
+            self.spawn(name, x, y, position)
+        return list(cells)
+
+    def read_area(self, content):
+        # map rows and legend of a map file
+        parser = configparser.ConfigParser()
+        parser.read_string(content.decode('utf-8'))
+        legend = [(section, sorted(parser.items(section))) for section in parser.sections() if section != 'level']
+        return (parser.get("level", "map").split("\n"), legend)
+
+    def digest(self, content):
+        # autotiles depend on which sprites exist, so they are hashed too
+        digest = hashlib.sha1(COMPILED_MAGIC + content)
+        for name in data.listdir('sprites'):
+            digest.update(name.encode('utf-8') + b'\0')
+        return digest.hexdigest()
+
+    def save_compiled(self, filename, digest):
+        # every distinct tile is stored once in the header followed by
+        # two byte tile indices, row by row
+        tiles = {}
+        indices = array.array('H')
+        for row in self.map:
+            for tile in row:
+                key = tuple(sorted(tile.items()))
+                indices.append(tiles.setdefault(key, len(tiles)))
+        if sys.byteorder != 'little':
+            indices.byteswap()
+
+        header = json.dumps({
+            'digest': digest,
+            'width': self.width,
+            'height': self.height,
+            'keys': self.keys,
+            'tiles': [dict(key) for key in sorted(tiles, key=tiles.get)],
+            'spawns': self.spawns,
+            'missing': self.missing
+        }).encode('utf-8')
+
+        # write to temporary file first so the game never reads half of it
+        with open(filename + '.tmp', 'wb') as f:
+            f.write(COMPILED_MAGIC)
+            f.write(struct.pack('<I', len(header)))
+            f.write(header)
+            f.write(indices.tobytes())
+        os.replace(filename + '.tmp', filename)
+
+    def load_compiled(self, filename, digest):
+        try:
+            with open(filename, 'rb') as f:
+                content = f.read()
+        except OSError:
+            return False
+        if not content.startswith(COMPILED_MAGIC):
+            return False
+        start = len(COMPILED_MAGIC) + 4
+        try:
+            (size,) = struct.unpack_from('<I', content, len(COMPILED_MAGIC))
+            header = json.loads(content[start:start + size].decode('utf-8'))
+        except (struct.error, ValueError):
+            return False
+        if header.get('digest') != digest:
+            return False
+
+        indices = array.array('H')
+        indices.frombytes(content[start + size:])
+        if sys.byteorder != 'little':
+            indices.byteswap()
+
+        # tiles are never changed once the level is parsed, so cells with
+        # the same tile can share it
+        self.keys = header['keys']
+        self.width = header['width']
+        self.height = header['height']
+        tiles = header['tiles']
+        self.map = [[tiles[i] for i in indices[y * self.width:(y + 1) * self.width]]
+                    for y in range(0, self.height)]
+        self.original_map = self.map
+        self.spawns = [tuple(spawn) for spawn in header['spawns']]
+        self.missing = [tuple(tile) for tile in header['missing']]
+
+        self.lanes = {}
+        for (name, x, y, position) in self.spawns:
+            if name == 'cannon':
+                self.build_lanes(x, y)
+        return True
+
+    def build_lanes(self, x, y):
+        # firing lane starts where cannon island ends and is clipped by sand
+        # of the next island, lanes are 3 tiles wide
+        starts = {}
+        for (direction, (dx, dy)) in DIRECTIONS.items():
+            on_island = True
+            for distance in range(1, CANNON_RANGE + 1):
+                (lane_x, lane_y) = (x + dx * distance, y + dy * distance)
+                if not (0 <= lane_x < self.width and 0 <= lane_y < self.height):
+                    break
+
+                name = self.get_tile(lane_x, lane_y)['name']
+                if on_island:
+                    if name in ('grass', 'sand'):
+                        continue
+                    on_island = False
+                    starts[direction] = distance
+                if name == 'sand':
+                    break
+
+                for side in (-1, 0, 1):
+                    tile = (lane_x + side * abs(dy), lane_y + side * abs(dx))
+                    self.lanes.setdefault(tile, []).append((x, y, direction))
+
+        # find closest water source so we know where cannon is pointing at,
+        # cannons with no water 3 tiles away point to their closest lane
+        position = None
+        for direction in ('left', 'right', 'up', 'down'):
+            (dx, dy) = DIRECTIONS[direction]
+            if self.get_tile(x + dx * 3, y + dy * 3)['name'] == 'water':
+                position = direction
+        if position is None and starts:
+            position = min(starts, key=starts.get)
+        return position or 'down'
+
+    def cannons_at(self, x, y):
+        # cannons which have tile in their firing lanes: [(cannon, direction)]
+        found = []
+        for (cannon_x, cannon_y, direction) in self.lanes.get((x, y), ()):
+            cannon = self.cannons.get((cannon_x, cannon_y))
+            if cannon is not None:
+                found.append((cannon, direction))
+        return found
+
+    def remove_cannon(self, cannon):
+        del self.cannons[(cannon.x, cannon.y)]
+        self.game.rotating.discard(cannon)
+
+    def spawn_entities(self):
+        # cannons by their position, for firing lane lookups
+        self.cannons = {}
+
+        for (name, x, y, position) in self.spawns:
+            self.spawn(name, x, y, position)
+
+    def spawn(self, name, x, y, position):
+        if name == 'cannon':
+            self.cannons[(x, y)] = Cannon(self.game, x, y, position)
+            self.game.cannons.append(self.cannons[(x, y)])
+        elif name == 'player':
+            if not self.game.player.initialized:
+                self.game.player.set_position(x, y)
+        elif name == 'heart':
+            self.game.hearts.append(Heart(self.game, x, y))
+        elif name == 'medal':
+            self.game.medals.append(Medal(self.game, x, y))
+        elif name == 'ship':
+            self.game.ships.append(Ship(self.game, x, y, random.choice(['up', 'down', 'right', 'left'])))
+
+    def view(self):
+        # level as it is now for the drawing thread: maps are replaced
+        # when the level changes (see reload), so a shallow copy keeps
+        # showing the same tiles while the game goes on
+        return copy.copy(self)
 
-        # cache image for quick reuse
-        image = pygame.transform.scale(
-                pygame.image.load('./data/sprites/' + name + '.png').convert_alpha(),
-                (TILE_WIDTH, TILE_HEIGHT))
-        self.images[name] = image
-        return self.images[name]
+    def get_sprite(self, name):
+        # images are cached by game assets for quick reuse
+        return self.game.assets.image(name, (TILE_WIDTH, TILE_HEIGHT))
 
     def get_tile(self, x, y):
         try:
@@ -663,480 +2126,685 @@ class Level(object):
             return self.keys['.']
 
 
-if __name__=='__main__':
-    # init pygame
-    pygame.init()
-    pygame.display.set_caption('Pirate Flow - Pygame #26')
-    pygame.key.set_repeat(100, 100)
-    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.DOUBLEBUF, 32)
-    screen.fill((255, 255, 255))
-
-    # load game storage
-    game = Game()
+class FlowField(object):
+    def __init__(self, level, distance=FLOW_RANGE, budget=FLOW_BUDGET):
+        self.width = level.width
+        self.height = level.height
+        self.range = distance
+        self.budget = budget
 
-    # load screen configuration
-    camera = Camera(game.level.width * TILE_WIDTH - SCREEN_WIDTH, game.level.height * TILE_HEIGHT - SCREEN_HEIGHT)
+        # ships sail on water and beach, same as the player
+        self.open = bytearray(self.width * self.height)
+        for y in range(0, self.height):
+            for x in range(0, self.width):
+                if level.get_tile(x, y)['name'] in ('water', 'beach'):
+                    self.open[y * self.width + x] = 1
+
+        # finished field: distance to the player and direction which leads
+        # closer, both indexed by tile; -1 is out of range
+        self.distances = array.array('i', [-1]) * (self.width * self.height)
+        self.directions = bytearray(self.width * self.height)
+        self.visited = []
+
+        # field being rebuilt after player moved, swapped in when finished
+        self.next_distances = array.array('i', [-1]) * (self.width * self.height)
+        self.next_directions = bytearray(self.width * self.height)
+        self.next_visited = []
+        self.queue = collections.deque()
+
+        self.source = None
+        self.names = (None, 'left', 'right', 'up', 'down')
+
+        # neighbour offsets and the direction leading back from them
+        self.steps = (
+            (-1, 0, 2),
+            (1, 0, 1),
+            (0, -1, 4),
+            (0, 1, 3)
+        )
+
+    def refresh(self, level, cells):
+        # level tiles changed, field is built again from scratch
+        for (x, y) in cells:
+            self.open[y * self.width + x] = level.get_tile(x, y)['name'] in ('water', 'beach')
+        self.reset()
+
+    def reset(self):
+        # forget both fields, next update() starts from scratch
+        self.restart(-1, -1)
+        for index in self.visited:
+            self.distances[index] = -1
+        self.visited = []
+        self.source = None
+
+    def update(self, x, y):
+        # start over when player enters another tile, then keep expanding
+        # the field within the budget
+        if (x, y) != self.source:
+            self.source = (x, y)
+            self.restart(x, y)
+        if self.queue:
+            self.expand(self.budget)
+
+    def restart(self, x, y):
+        for index in self.next_visited:
+            self.next_distances[index] = -1
+        self.next_visited = []
+        self.queue.clear()
+
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return
+        index = y * self.width + x
+        self.next_distances[index] = 0
+        self.next_directions[index] = 0
+        self.next_visited.append(index)
+        self.queue.append((x, y, 0))
+
+    def expand(self, budget):
+        (width, height) = (self.width, self.height)
+        (distances, directions) = (self.next_distances, self.next_directions)
+        (queue, visited, is_open) = (self.queue, self.next_visited, self.open)
+
+        while queue and budget > 0:
+            budget -= 1
+            (x, y, distance) = queue.popleft()
+            if distance == self.range:
+                continue
+            for (dx, dy, back) in self.steps:
+                (nx, ny) = (x + dx, y + dy)
+                if not (0 <= nx < width and 0 <= ny < height):
+                    continue
+                index = ny * width + nx
+                if distances[index] != -1 or not is_open[index]:
+                    continue
+                distances[index] = distance + 1
+                directions[index] = back
+                visited.append(index)
+                queue.append((nx, ny, distance + 1))
+
+        # field is complete, let ships use it
+        if not queue:
+            (self.distances, self.next_distances) = (self.next_distances, self.distances)
+            (self.directions, self.next_directions) = (self.next_directions, self.directions)
+            (self.visited, self.next_visited) = (self.next_visited, self.visited)
+
+    def distance(self, x, y):
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return -1
+        return self.distances[y * self.width + x]
+
+    def toward(self, x, y):
+        # direction which brings ship one tile closer to the player
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return None
+        return self.names[self.directions[y * self.width + x]]
+
+    def is_open(self, x, y):
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return False
+        return self.open[y * self.width + x] == 1
+
+
+class RenderQueue(object):
+    def __init__(self, layers=LAYERS, trace=None):
+        # draw commands (surface, position) of each layer, layers are
+        # drawn in given order
+        self.layers = layers
+        self.commands = dict((layer, []) for layer in layers)
+
+        # counts alpha blended blits when debugging
+        self.trace = trace
+
+        # offsets which center sprite of given size on a tile
+        self.offsets = {}
+
+    def add(self, layer, surface, position):
+        self.commands[layer].append((surface, position))
+
+    def layer(self, layer):
+        # list of commands to append to directly in busy loops
+        return self.commands[layer]
+
+    def offset(self, surface):
+        size = surface.get_size()
+        offset = self.offsets.get(size)
+        if offset is None:
+            offset = self.offsets[size] = (int(TILE_WIDTH / 2) - int(size[0] / 2), int(TILE_HEIGHT / 2) - int(size[1] / 2))
+        return offset
+
+    def add_centered(self, layer, surface, x, y):
+        # x, y are tile coordinates on the screen
+        offset = self.offset(surface)
+        self.commands[layer].append((surface, (int(x * TILE_WIDTH) + offset[0], int(y * TILE_HEIGHT) + offset[1])))
+
+    def add_particles(self, layer, particles, camera):
+        # particles snapshot (see Particles.snapshot), batches which can't
+        # reach the screen are skipped, offsets of the rest are moved by
+        # their origin and the camera with no python code run per particle
+        (surfaces, batches) = particles
+        (camera_x, camera_y) = (camera.x * TILE_WIDTH, camera.y * TILE_HEIGHT)
+        (left, top) = (camera_x - TILE_WIDTH * 2, camera_y - TILE_HEIGHT * 2)
+        (right, bottom) = (camera_x + SCREEN_WIDTH + TILE_WIDTH * 2, camera_y + SCREEN_HEIGHT + TILE_HEIGHT * 2)
+        commands = self.commands[layer]
+        for (sprite, x, y, reach, origin_x, origin_y, xs, ys) in batches:
+            if x + reach < left or x - reach >= right or y + reach < top or y - reach >= bottom:
+                continue
+            commands.extend(zip(itertools.repeat(surfaces[sprite]),
+                                zip(map(operator.add, xs, itertools.repeat(origin_x - camera_x)),
+                                    map(operator.add, ys, itertools.repeat(origin_y - camera_y)))))
+
+    def submit(self, screen):
+        # one blits() call per layer
+        if self.trace is not None:
+            self.count()
+        for layer in self.layers:
+            commands = self.commands[layer]
+            if commands:
+                screen.blits(commands, False)
+                del commands[:]
+
+    def count(self):
+        self.trace.frame()
+        for layer in self.layers:
+            alpha = 0
+            for (surface, position) in self.commands[layer]:
+                if surface.get_flags() & pygame.SRCALPHA:
+                    alpha += 1
+            self.trace.add(layer, len(self.commands[layer]), alpha)
+
+
+class Minimap(object):
+    def __init__(self, level, size=MINIMAP_SIZE):
+        # terrain is drawn once per level, one pixel per sampled tile and
+        # then zoomed so small maps are not tiny
+        self.step = max(1, int(math.ceil(max(level.width, level.height) / float(size))))
+        columns = int(math.ceil(level.width / float(self.step)))
+        rows = int(math.ceil(level.height / float(self.step)))
+        self.zoom = max(1, size // max(columns, rows))
+
+        pixels = bytearray(columns * rows * 3)
+        for row in range(0, rows):
+            for column in range(0, columns):
+                name = level.get_tile(column * self.step, row * self.step)['name']
+                offset = (row * columns + column) * 3
+                pixels[offset:offset + 3] = bytes(MINIMAP_COLORS.get(name, MINIMAP_COLORS['water']))
+        terrain = pygame.image.frombuffer(bytes(pixels), (columns, rows), 'RGB')
+        self.terrain = pygame.transform.scale(terrain, (columns * self.zoom, rows * self.zoom)).convert()
+
+        # framed terrain with markers, redrawn every frame
+        self.surface = pygame.Surface((self.terrain.get_width() + 2, self.terrain.get_height() + 2)).convert()
+
+    def refresh(self, level, cells):
+        # redraw only changed tiles which are sampled into the minimap, on
+        # a copy which replaces terrain the drawing thread may be using
+        terrain = self.terrain.copy()
+        for (x, y) in cells:
+            if x % self.step or y % self.step:
+                continue
+            color = MINIMAP_COLORS.get(level.get_tile(x, y)['name'], MINIMAP_COLORS['water'])
+            terrain.fill(color, (x // self.step * self.zoom, y // self.step * self.zoom, self.zoom, self.zoom))
+        self.terrain = terrain
+
+    def point(self, left, top, x, y, size):
+        # marker rectangle of object at tile x, y
+        return (left + x * self.zoom // self.step - size // 2, top + y * self.zoom // self.step - size // 2, size, size)
+
+    def draw(self, snapshot, camera):
+        # return minimap with markers of moving objects on it, terrain is
+        # only copied
+        (surface, left, top) = (self.surface, 1, 1)
+        surface.blit(self.terrain, (left, top))
+
+        # only moving objects are drawn every frame
+        for (x, y, image) in snapshot.cannons:
+            surface.fill(MINIMAP_COLORS['cannon'], self.point(left, top, x, y, 2))
+        for (x, y, image) in snapshot.hearts:
+            surface.fill(MINIMAP_COLORS['heart'], self.point(left, top, x, y, 3))
+        for (x, y, image) in snapshot.medals:
+            surface.fill(MINIMAP_COLORS['medal'], self.point(left, top, x, y, 3))
+        for (x, y, image) in snapshot.ships:
+            surface.fill(MINIMAP_COLORS['ship'], self.point(left, top, x, y, 3))
+        if snapshot.alive:
+            (x, y, image) = snapshot.player
+            surface.fill(MINIMAP_COLORS['player'], self.point(left, top, x, y, 4))
+
+        # visible part of the level
+        view = (left + camera.x * self.zoom // self.step, top + camera.y * self.zoom // self.step,
+                SCREEN_WIDTH // TILE_WIDTH * self.zoom // self.step, SCREEN_HEIGHT // TILE_HEIGHT * self.zoom // self.step)
+        pygame.draw.rect(surface, MINIMAP_COLORS['player'], view, 1)
+
+        # frame around the map
+        pygame.draw.rect(surface, (0, 0, 0), surface.get_rect(), 1)
+        return surface
+
+
+def draw_frame(screen, game, snapshot, camera):
+    queue = game.render_queue
 
     # get background tile - water
-    water_tile = pygame.image.load('./data/sprites/water.png').convert_alpha()
-    water_tile = pygame.transform.scale(water_tile, (TILE_WIDTH, TILE_HEIGHT))
-
-    sandbg = pygame.image.load('./data/sprites/sandbg.png').convert_alpha()
-    sandbg = pygame.transform.scale(sandbg, (TILE_WIDTH, TILE_HEIGHT))
-
-    panel_start = pygame.image.load('./data/sprites/panel-start.png').convert_alpha()
-    panel_body = pygame.image.load('./data/sprites/panel-body.png').convert_alpha()
-    panel_end = pygame.image.load('./data/sprites/panel-end.png').convert_alpha()
-    star = pygame.image.load('./data/sprites/star.png').convert_alpha()
-
-    achievements = pygame.image.load('./data/sprites/achievements.png').convert_alpha()
-    shoot = pygame.image.load('./data/sprites/shoot.png').convert_alpha()
-    shoot = pygame.transform.scale(shoot, (TILE_WIDTH * 2, TILE_HEIGHT * 2))
-    world = pygame.image.load('./data/sprites/world.png').convert_alpha()
-    world = pygame.transform.scale(world, (TILE_WIDTH * 2, TILE_HEIGHT * 2))
-    medal = pygame.image.load('./data/sprites/medal.png').convert_alpha()
-    medal = pygame.transform.scale(medal, (TILE_WIDTH * 2, TILE_HEIGHT * 2))
-
-    water = 0
-    playing = True
-    while playing:
-        # water animation
-        water += 2
-        if water == 32: water = 0
-
-        # render player
-        game.player.move()
-
-        # position camera so it is always shows centered ship
-        camera.x = game.player.x - int(SCREEN_WIDTH / 2 / TILE_WIDTH)
-        camera.y = game.player.y - int(SCREEN_HEIGHT / 2 / TILE_HEIGHT)
-
-        # do not allow camera go over world boundaries
-        if camera.x < 0: camera.x = 0
-        if camera.y < 0: camera.y = 0
-        if camera.x > game.level.width - int(SCREEN_WIDTH / 2 / TILE_WIDTH):
-            camera.x = game.level.width - int(SCREEN_WIDTH / 2 / TILE_WIDTH)
-        if camera.y > game.level.height - int(SCREEN_HEIGHT / 2 / TILE_HEIGHT):
-            camera.y = game.level.height - int(SCREEN_HEIGHT / 2 / TILE_HEIGHT)
-
-        for x in range(-1, int(SCREEN_WIDTH / TILE_WIDTH) + 1):
-            for y in range(-1, int(SCREEN_HEIGHT / TILE_HEIGHT) + 1):
-                # render floating water - background layer
-                screen.blit(water_tile, (x * TILE_WIDTH + water, y * TILE_HEIGHT + water))
-
-                # render tiles
-                tile = game.level.get_tile(x + camera.x, y + camera.y)
-                if tile['name'] != 'water':
-                    if tile['name'] == 'sand':
-                        screen.blit(sandbg, (x * TILE_WIDTH, y * TILE_HEIGHT))
-                    screen.blit(game.level.get_sprite(tile['image']), (x * TILE_WIDTH, y * TILE_HEIGHT))
-
-        if game.achievements.distance_traveled == game.achievements.distance_goal:
-            game.achievements.distance_reached = True
-
-            # play achievement sound
-            sound = pygame.mixer.Sound('./data/music/achievement.wav')
-            sound.set_volume(0.3)
-            sound.play()
-        if game.player.is_alive:
-            image = game.player.image()
-            screen.blit(image, (int((game.player.x - camera.x) * TILE_WIDTH) + int(TILE_WIDTH / 2) - int(image.get_width() / 2), int((game.player.y - camera.y) * TILE_HEIGHT) + int(TILE_HEIGHT / 2) - int(image.get_height() / 2)))
-
-        # render bullets and see if somebody hit somebody
-        for bullet in game.bullets:
-            bullet.move()
-            if bullet.finished():
-                missed = True
-                if bullet.reaches(game.player):
-                    missed = False
-                    game.player.energy -= 1
-                    if game.player.energy <= 0:
-                        game.player.dead()
-                    game.explosions.append(Explosion(game, bullet.x, bullet.y, 'medium'))
-                    sound = pygame.mixer.Sound('./data/music/explosion.wav')
-                    sound.set_volume(0.6)
-                    sound.play()
-                else:
-                    # check to see if any bullet reaches enemy ship
-                    for ship in game.ships:
-                        if bullet.reaches(ship):
-                            game.player.score += 250
-
-                            if not game.achievements.score_reached and game.player.score > game.achievements.score_goal:
-                                game.achievements.score_reached = True
-
-                                # play another achievement reached music
-                                sound = pygame.mixer.Sound('./data/music/achievement.wav')
-                                sound.set_volume(0.3)
-                                sound.play()
-
-                            missed = False
-                            game.cannons.remove(cannon)
-                            game.ships.remove(ship)
-                            game.explosions.append(Explosion(game, bullet.x, bullet.y, 'small'))
-
-                            # play explosion sound
-                            sound = pygame.mixer.Sound('./data/music/explosion.wav')
-                            sound.set_volume(0.5)
-                            sound.play()
-
-                            break # same bullet can't hit few items
-
-                    # check to see if any bullet reaches cannons
-                    for cannon in game.cannons:
-                        if bullet.reaches(cannon):
-                            game.player.score += 100
-                            if not game.achievements.score_reached and game.player.score > game.achievements.score_goal:
-                                game.achievements.score_reached = True
-
-                                # play another achievement reached music
-                                sound = pygame.mixer.Sound('./data/music/achievement.wav')
-                                sound.set_volume(0.3)
-                                sound.play()
-
-                            missed = False
-                            game.cannons.remove(cannon)
-                            game.explosions.append(Explosion(game, bullet.x, bullet.y, 'small'))
-
-                            # check player achievements
-                            game.achievements.cannons_killed += 1
-                            game.achievements.cannons_reached = game.achievements.cannons_killed >= game.achievements.cannons_goal
-
-                            # play achievement unlocked song
-                            if game.achievements.cannons_killed == game.achievements.cannons_goal:
-                                sound = pygame.mixer.Sound('./data/music/achievement.wav')
-                                sound.set_volume(0.3)
-                                sound.play()
-
-                            # play explosion sound
-                            sound = pygame.mixer.Sound('./data/music/explosion.wav')
-                            sound.set_volume(0.5)
-                            sound.play()
-
-                            break # same bullet can't hit few items
-                if missed:
-                    game.explosions.append(Explosion(game, bullet.x, bullet.y, 'tiny'))
-                    sound = pygame.mixer.Sound('./data/music/explosion.wav')
-                    sound.set_volume(0.05)
-                    sound.play()
-                game.bullets.remove(bullet)
-            else:
-                image = bullet.image()
-                screen.blit(image, (int((bullet.x - camera.x) * TILE_WIDTH) + int(TILE_WIDTH / 2) - int(image.get_width() / 2), int((bullet.y - camera.y) * TILE_HEIGHT) + int(TILE_HEIGHT / 2) - int(image.get_height() / 2)))
-
-        # render bullet explosions
-        for explosion in game.explosions:
-            if explosion.finished():
-                game.explosions.remove(explosion)
+    water_tile = game.assets.image('water', (TILE_WIDTH, TILE_HEIGHT))
+    sandbg = game.assets.image('sandbg', (TILE_WIDTH, TILE_HEIGHT))
+
+    panel_start = game.assets.image('panel-start')
+    panel_body = game.assets.image('panel-body')
+    panel_end = game.assets.image('panel-end')
+    star = game.assets.image('star')
+
+    achievements = game.assets.image('achievements')
+
+    # position camera so it is always shows centered ship
+    (player_x, player_y, player_image) = snapshot.player
+    camera.x = player_x - int(SCREEN_WIDTH / 2 / TILE_WIDTH)
+    camera.y = player_y - int(SCREEN_HEIGHT / 2 / TILE_HEIGHT)
+
+    # do not allow camera go over world boundaries
+    if camera.x < 0: camera.x = 0
+    if camera.y < 0: camera.y = 0
+    if camera.x > snapshot.level.width - int(SCREEN_WIDTH / 2 / TILE_WIDTH):
+        camera.x = snapshot.level.width - int(SCREEN_WIDTH / 2 / TILE_WIDTH)
+    if camera.y > snapshot.level.height - int(SCREEN_HEIGHT / 2 / TILE_HEIGHT):
+        camera.y = snapshot.level.height - int(SCREEN_HEIGHT / 2 / TILE_HEIGHT)
+
+    # terrain sprites are blitted in two big batches
+    (water, terrain) = (queue.layer('water'), queue.layer('terrain'))
+    for x in range(-1, int(SCREEN_WIDTH / TILE_WIDTH) + 1):
+        for y in range(-1, int(SCREEN_HEIGHT / TILE_HEIGHT) + 1):
+            # render floating water - background layer
+            water.append((water_tile, (x * TILE_WIDTH + snapshot.water, y * TILE_HEIGHT + snapshot.water)))
+
+            # render tiles
+            tile = snapshot.level.get_tile(x + camera.x, y + camera.y)
+            if tile['name'] != 'water':
+                if tile['name'] == 'sand':
+                    terrain.append((sandbg, (x * TILE_WIDTH, y * TILE_HEIGHT)))
+                terrain.append((snapshot.level.get_sprite(tile['image']), (x * TILE_WIDTH, y * TILE_HEIGHT)))
+
+    if snapshot.alive:
+        queue.add_centered('player', player_image, player_x - camera.x, player_y - camera.y)
+
+    # explosions and debris go in one batch, skipping those off the screen
+    queue.add_particles('particles', snapshot.particles, camera)
+
+    # render bullets, special items and enemies
+    for (layer, group) in (('bullets', snapshot.bullets), ('items', snapshot.hearts), ('items', snapshot.medals),
+                           ('cannons', snapshot.cannons), ('ships', snapshot.ships)):
+        for (x, y, image) in group:
+            queue.add_centered(layer, image, x - camera.x, y - camera.y)
+
+    # informational text
+    if snapshot.started:
+        queue.add('hud', panel_start, (20, SCREEN_HEIGHT - 50))
+        for i in range(1, 210, 4):
+            queue.add('hud', panel_body, (20 + i, SCREEN_HEIGHT - 50))
+        queue.add('hud', panel_end, (20 + i, SCREEN_HEIGHT - 50))
+
+        # draw shadow HEALTH text
+        health_text = 'HEALTH:'
+        (width, height) = game.small_font.size(health_text)
+        text = game.small_font.render(health_text, False, (0, 0, 0))
+        queue.add('hud', text, (28, SCREEN_HEIGHT - 45))
+
+        # draw normal HEALTH text
+        text = game.small_font.render(health_text, False, (255, 255, 255))
+        queue.add('hud', text, (27, SCREEN_HEIGHT - 46))
+
+        # draw energy stars
+        for energy in range(0, snapshot.energy):
+            queue.add('hud', star, (width + 36 + energy * 19, SCREEN_HEIGHT - 44))
+
+        # draw shadow SCORE text
+        score_text = 'Score: {}'.format(snapshot.score)
+        (width, height) = game.regular_font.size(score_text)
+        text = game.regular_font.render(score_text, False, (255, 255, 255))
+        queue.add('hud', text, (SCREEN_WIDTH - width - 20, 21))
+
+        # draw normal SCORE text
+        text = game.regular_font.render(score_text, False, (0, 0, 0))
+        queue.add('hud', text, (SCREEN_WIDTH - width - 21, 20))
+
+       #  draw shadow PRESS A text
+        score_text = 'Press A'
+        (width, height) = game.regular_font.size(score_text)
+        text = game.regular_font.render(score_text, False, (0, 0, 0))
+        queue.add('hud', text, (SCREEN_WIDTH - width - 20, SCREEN_HEIGHT - 40))
+
+        #  draw normal PRESS A text
+        text = game.regular_font.render(score_text, False, (255, 255, 255))
+        queue.add('hud', text, (SCREEN_WIDTH - width - 21, SCREEN_HEIGHT - 41))
+
+        # draw achievements box
+        queue.add('hud', achievements, (SCREEN_WIDTH - 90, SCREEN_HEIGHT - 110))
+
+        # draw level overview
+        if snapshot.show_minimap and snapshot.screen == 'gameplay':
+            queue.add('hud', snapshot.minimap.draw(snapshot, camera), (19, 19))
+
+    # draw text saying that player lost the game
+    if snapshot.lost:
+        title = 'GAME OVER'
+        (width, height) = game.title_font.size(title)
+
+        # draw shadown GAME OVER text
+        text = game.title_font.render(title, False, (0, 0, 0))
+        queue.add('text', text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 1, int(SCREEN_HEIGHT / 2) - int(height / 2) + 1))
+
+        # draw normal GAME OVER text
+        text = game.title_font.render(title, False, (255, 255, 255))
+        queue.add('text', text, (int(SCREEN_WIDTH) / 2 - int(width / 2), int(SCREEN_HEIGHT / 2) - int(height / 2)))
+
+        # draw shadow PRESS SPACE text
+        text = game.regular_font.render('Press SPACE to play again', False, (0, 0, 0))
+        queue.add('text', text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 1, int(SCREEN_HEIGHT / 2) + int(height / 2) + 1))
+
+        # draw normal PRESS SPACE text
+        text = game.regular_font.render('Press SPACE to play again', False, (255, 255, 255))
+        queue.add('text', text, (int(SCREEN_WIDTH) / 2 - int(width / 2), int(SCREEN_HEIGHT / 2) + int(height / 2)))
+
+    if snapshot.started and snapshot.screen == 'achievements':
+        title = 'Achievements'
+        (width, height) = game.title_font.size(title)
+
+        # draw shadow ACHIEVEMENTS text
+        text = game.title_font.render(title, False, (0, 0, 0))
+        queue.add('text', text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 1, int(SCREEN_HEIGHT / 2) - int(height / 2) + 1 - 250))
+
+        # draw normal ACHIEVEMENTS text
+        text = game.title_font.render(title, False, (255, 255, 255))
+        queue.add('text', text, (int(SCREEN_WIDTH) / 2 - int(width / 2), int(SCREEN_HEIGHT / 2) - int(height / 2) - 250))
+
+        # draw shadow PRESS SPACE text
+        text = game.regular_font.render('Press SPACE to return to the game', False, (0, 0, 0))
+        queue.add('text', text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 1, int(SCREEN_HEIGHT / 2) + int(height / 2) + 1 - 250))
+
+        # draw normal PRESS SPACE text
+        text = game.regular_font.render('Press SPACE to return to the game', False, (255, 255, 255))
+        queue.add('text', text, (int(SCREEN_WIDTH) / 2 - int(width / 2), int(SCREEN_HEIGHT / 2) + int(height / 2) - 250))
+
+        for (i, (icon, goal_title, status, reached)) in enumerate(snapshot.goals):
+            left = int(SCREEN_WIDTH) / 2 - int(width / 2)
+            top = int(SCREEN_HEIGHT / 2) + int(height / 2) - 180 + i * 100
+
+            # achievement icons are loaded only when screen is opened
+            queue.add('text', game.assets.image(icon, (TILE_WIDTH * 2, TILE_HEIGHT * 2)), (left + 1, top + 1))
+            if reached:
+                (shadow, color) = ((0, 0, 0), (255, 255, 255))
             else:
-                image = explosion.image()
-                screen.blit(image, (int((explosion.x - camera.x) * TILE_WIDTH) + int(TILE_WIDTH / 2) - int(image.get_width() / 2), int((explosion.y - camera.y) * TILE_HEIGHT) + int(TILE_HEIGHT / 2) - int(image.get_height() / 2)))
-
-        # render special items - hearts
-        for heart in game.hearts:
-            if heart.reaches(game.player):
-                # play healt song
-                sound = pygame.mixer.Sound('./data/music/healt.wav')
-                sound.set_volume(0.2)
-                sound.play()
-
-                game.player.score += 50
+                (shadow, color) = ((255, 255, 255), (0, 0, 0))
+
+            # draw shadow GOAL text
+            text = game.big_font.render(goal_title, False, shadow)
+            queue.add('text', text, (left + 1 + 80, top + 1 + 10))
+
+            # draw normal GOAL text
+            text = game.big_font.render(goal_title, False, color)
+            queue.add('text', text, (left + 80, top + 10))
+
+            # draw shadow STATUS text
+            text = game.small_font.render(status, False, shadow)
+            queue.add('text', text, (left + 1 + 80, top + 1 + 35))
+
+            # draw normal STATUS text
+            text = game.small_font.render(status, False, color)
+            queue.add('text', text, (left + 80, top + 35))
+
+    queue.submit(screen)
+
+    # title is drawn on top of everything
+    if not snapshot.started:
+        draw_title(screen, game, 'Press SPACE to start the game')
+
+
+def draw_title(screen, game, subtitle):
+    title = 'Pirate Flow'
+    (width, height) = game.title_font.size(title)
+
+    # draw shadow PIRATE FLOW text
+    text = game.title_font.render(title, False, (0, 0, 0))
+    screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 1, int(SCREEN_HEIGHT / 2) - int(height / 2) + 1))
+
+    # draw normal PIRATE FLOW text
+    text = game.title_font.render(title, False, (255, 255, 255))
+    screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2), int(SCREEN_HEIGHT / 2) - int(height / 2)))
+
+    # draw shadow subtitle text
+    text = game.regular_font.render(subtitle, False, (0, 0, 0))
+    screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 1, int(SCREEN_HEIGHT / 2) + int(height / 2) + 1))
+
+    # draw normal subtitle text
+    text = game.regular_font.render(subtitle, False, (255, 255, 255))
+    screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2), int(SCREEN_HEIGHT / 2) + int(height / 2)))
+
+
+def size(text):
+    # WIDTHxHEIGHT command line argument
+    try:
+        (width, height) = [int(n) for n in text.lower().split('x')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('size must look like 928x736')
+    if width <= 0 or height <= 0:
+        raise argparse.ArgumentTypeError('size must be positive')
+    return (width, height)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Pirate Flow')
+    parser.add_argument('--level', default='./data/levels/1.map',
+                        help='level file to play (default: %(default)s)')
+    parser.add_argument('--watch-level', action='store_true',
+                        help='reload level file whenever it is saved (for editing levels)')
+    parser.add_argument('--resolution', type=size, default='%dx%d' % (SCREEN_WIDTH, SCREEN_HEIGHT),
+                        help='size the game is scaled to, the view stays the same (default: %(default)s)')
+    parser.add_argument('--window', type=size,
+                        help='window size, game is scaled to fit it (default: same as resolution)')
+    parser.add_argument('--fullscreen', action='store_true',
+                        help='scale the game to fill the whole screen')
+    parser.add_argument('--smooth', action='store_true',
+                        help='smooth scaling instead of sharp pixels')
+    parser.add_argument('--trace-startup', action='store_true',
+                        help='report time spent in each start up phase')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='skip drawing frames instead of slowing down on slow machines')
+    parser.add_argument('--low-latency', action='store_true',
+                        help='draw next frame as soon as a key is pressed')
+    parser.add_argument('--threaded', action='store_true',
+                        help='update game world on a separate thread')
+    parser.add_argument('--trace-blits', action='store_true',
+                        help='report alpha blended (slow) blits per frame')
+    parser.add_argument('--trace-input', action='store_true',
+                        help='report time from key press until it shows on the screen')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='report memory allocated per frame and garbage collector pauses')
+    parser.add_argument('--memory-budget', type=float, metavar='KB', nargs='?', const=MEMORY_BUDGET,
+                        help='exit with error if more than 5%% of frames allocate more (default: %d, implies --trace-memory)'
+                             % MEMORY_BUDGET)
+    parser.add_argument('--frames', type=int,
+                        help='quit after this many frames')
+    parser.add_argument('--autoplay', action='store_true',
+                        help='let the game play by itself, for measurements')
+    parser.add_argument('--stress-particles', type=int, metavar='COUNT', default=0,
+                        help='keep this many particles flying around the player, for measurements')
+    parser.add_argument('--soak', type=float, metavar='MINUTES',
+                        help='play by itself for this long and report values which keep growing (implies --autoplay)')
+    parser.add_argument('--soak-log', metavar='FILE',
+                        help='write soak test samples to CSV file')
+    args = parser.parse_args()
+    if args.memory_budget is not None:
+        args.trace_memory = True
+    if args.soak is not None:
+        args.autoplay = True
+    if args.threaded and (args.trace_memory or args.soak is not None):
+        parser.error('--trace-memory and --soak measure single threaded game only')
+    return args
 
-                # check to see if player has not reached a goal yet
-                if not game.achievements.score_reached and game.player.score > game.achievements.score_goal:
-                    game.achievements.score_reached = True
-
-                    # play another achievement reached music
-                    sound = pygame.mixer.Sound('./data/music/achievement.wav')
-                    sound.set_volume(0.3)
-                    sound.play()
-
-                # add health to the user
-                if game.player.energy < game.player.max_energy:
-                    game.player.energy += 1
 
-                # drop collected item
-                game.hearts.remove(heart)
-            else:
-                image = heart.image()
-                screen.blit(image, (int((heart.x - camera.x) * TILE_WIDTH) + int(TILE_WIDTH / 2) - int(image.get_width() / 2), int((heart.y - camera.y) * TILE_HEIGHT) + int(TILE_HEIGHT / 2) - int(image.get_height() / 2)))
-
-        # render special items - medals
-        for mini_medal in game.medals:
-            if mini_medal.reaches(game.player):
-                # play healt song
-                sound = pygame.mixer.Sound('./data/music/medal.wav')
-                sound.set_volume(0.2)
-                sound.play()
-
-                game.player.score += 500
-
-                # check to see if player has not reached a goal yet
-                if not game.achievements.score_reached and game.player.score > game.achievements.score_goal:
-                    game.achievements.score_reached = True
-
-                    # play another achievement reached music
-                    sound = pygame.mixer.Sound('./data/music/achievement.wav')
-                    sound.set_volume(0.3)
-                    sound.play()
-
-                # drop collected item
-                game.medals.remove(mini_medal)
-            else:
-                image = mini_medal.image()
-                screen.blit(image, (int((mini_medal.x - camera.x) * TILE_WIDTH) + int(TILE_WIDTH / 2) - int(image.get_width() / 2), int((mini_medal.y - camera.y) * TILE_HEIGHT) + int(TILE_HEIGHT / 2) - int(image.get_height() / 2)))
-
-        # render first enemy group - cannons
-        for cannon in game.cannons:
-            if game.screen == "gameplay":
-                cannon.move()
-            image = cannon.image()
-            screen.blit(image, (int((cannon.x - camera.x) * TILE_WIDTH) + int(TILE_WIDTH / 2) - int(image.get_width() / 2), int((cannon.y - camera.y) * TILE_HEIGHT) + int(TILE_HEIGHT / 2) - int(image.get_height() / 2)))
-
-        # render second enemy group - ships
-        for ship in game.ships:
-            if game.screen == "gameplay":
-                ship.move()
-            image = ship.image()
-            screen.blit(image, (int((ship.x - camera.x) * TILE_WIDTH) + int(TILE_WIDTH / 2) - int(image.get_width() / 2), int((ship.y - camera.y) * TILE_HEIGHT) + int(TILE_HEIGHT / 2) - int(image.get_height() / 2)))
-
-        # informational text
-        if game.started:
-            screen.blit(panel_start, (20, SCREEN_HEIGHT - 50))
-            for i in range(1, 210, 4):
-                screen.blit(panel_body, (20 + i, SCREEN_HEIGHT - 50))
-            screen.blit(panel_end, (20 + i, SCREEN_HEIGHT - 50))
-
-            # draw shadow HEALTH text
-            health_text = 'HEALTH:'
-            (width, height) = game.small_font.size(health_text)
-            text = game.small_font.render(health_text, False, (0, 0, 0))
-            screen.blit(text, (28, SCREEN_HEIGHT - 45))
-
-            # draw normal HEALTH text
-            text = game.small_font.render(health_text, False, (255, 255, 255))
-            screen.blit(text, (27, SCREEN_HEIGHT - 46))
-
-            # draw energy stars
-            for energy in range(0, game.player.energy):
-                screen.blit(star, (width + 36 + energy * 19, SCREEN_HEIGHT - 44))
-
-            # draw shadow SCORE text
-            score_text = 'Score: {}'.format(game.player.score)
-            (width, height) = game.regular_font.size(score_text)
-            text = game.regular_font.render(score_text, False, (255, 255, 255))
-            screen.blit(text, (SCREEN_WIDTH - width - 20, 21))
-
-            # draw normal SCORE text
-            text = game.regular_font.render(score_text, False, (0, 0, 0))
-            screen.blit(text, (SCREEN_WIDTH - width - 21, 20))
-
-           #  draw shadow PRESS A text
-            score_text = 'Press A'
-            (width, height) = game.regular_font.size(score_text)
-            text = game.regular_font.render(score_text, False, (0, 0, 0))
-            screen.blit(text, (SCREEN_WIDTH - width - 20, SCREEN_HEIGHT - 40))
-
-            #  draw normal PRESS A text
-            text = game.regular_font.render(score_text, False, (255, 255, 255))
-            screen.blit(text, (SCREEN_WIDTH - width - 21, SCREEN_HEIGHT - 41))
-
-            # draw achievements box
-            screen.blit(achievements, (SCREEN_WIDTH - 90, SCREEN_HEIGHT - 110))
-
-        # draw text saying that player lost the game
-        if game.player.has_lost():
-            title = 'GAME OVER'
-            (width, height) = game.title_font.size(title)
-
-            # draw shadown GAME OVER text
-            text = game.title_font.render(title, False, (0, 0, 0))
-            screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 1, int(SCREEN_HEIGHT / 2) - int(height / 2) + 1))
-
-            # draw normal GAME OVER text
-            text = game.title_font.render(title, False, (255, 255, 255))
-            screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2), int(SCREEN_HEIGHT / 2) - int(height / 2)))
-
-            # lower the sound to make everything more sad to the player
-            if pygame.mixer.music.get_volume() >= 0.1:
-                pygame.mixer.music.set_volume(pygame.mixer.music.get_volume() - 0.02)
-
-        if not game.started:
-            title = 'Pirate Flow'
-            (width, height) = game.title_font.size(title)
+if __name__=='__main__':
+    args = parse_args()
+    trace = profiling.StartupTrace(START_TIME, enabled=args.trace_startup)
+    trace.mark('imports')
+
+    # init only pygame parts needed for the first frame, mixer is started
+    # together with the loader
+    pygame.display.init()
+    pygame.font.init()
+    pygame.display.set_caption('Pirate Flow - Pygame #26')
+    pygame.key.set_repeat(100, 100)
 
-            # draw shadow PIRATE FLOW text
-            text = game.title_font.render(title, False, (0, 0, 0))
-            screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 1, int(SCREEN_HEIGHT / 2) - int(height / 2) + 1))
+    display = Display(args.resolution, args.window, args.fullscreen, args.smooth)
+    display.canvas.fill((255, 255, 255))
+    trace.mark('display')
 
-            # draw normal PIRATE FLOW text
-            text = game.title_font.render(title, False, (255, 255, 255))
-            screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2), int(SCREEN_HEIGHT / 2) - int(height / 2)))
+    # load game storage
+    game = Game()
 
-            # draw shadow PRESS SPACE text
-            text = game.regular_font.render('Press SPACE to start the game'.format(game.player.energy, game.player.max_energy), False, (0, 0, 0))
-            screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 1, int(SCREEN_HEIGHT / 2) + int(height / 2) + 1))
+    display.canvas.fill((171, 227, 245))
+    draw_title(display.canvas, game, 'Loading...')
+    display.present()
+    trace.mark('first frame')
 
-            # draw normal PRESS SPACE text
-            text = game.regular_font.render('Press SPACE to start the game'.format(game.player.energy, game.player.max_energy), False, (255, 255, 255))
-            screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2), int(SCREEN_HEIGHT / 2) + int(height / 2)))
-        else:
-            # add some background music volume when game has started
-            if pygame.mixer.music.get_volume() < 0.4:
-                pygame.mixer.music.set_volume(pygame.mixer.music.get_volume() + 0.01)
+    game.start_loading(trace, args.level)
+    trace.mark('mixer')
 
-            if game.screen == 'achievements':
-                title = 'Achievements'
-                (width, height) = game.title_font.size(title)
-
-                # draw shadow ACHIEVEMENTS text
-                text = game.title_font.render(title, False, (0, 0, 0))
-                screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 1, int(SCREEN_HEIGHT / 2) - int(height / 2) + 1 - 250))
-
-                # draw normal ACHIEVEMENTS text
-                text = game.title_font.render(title, False, (255, 255, 255))
-                screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2), int(SCREEN_HEIGHT / 2) - int(height / 2) - 250))
-
-                # draw shadow PRESS SPACE text
-                text = game.regular_font.render('Press SPACE to return to the game'.format(game.player.energy, game.player.max_energy), False, (0, 0, 0))
-                screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 1, int(SCREEN_HEIGHT / 2) + int(height / 2) + 1 - 250))
-
-                # draw normal PRESS SPACE text
-                text = game.regular_font.render('Press SPACE to return to the game'.format(game.player.energy, game.player.max_energy), False, (255, 255, 255))
-                screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2), int(SCREEN_HEIGHT / 2) + int(height / 2) - 250))
-
-                screen.blit(shoot, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 1, int(SCREEN_HEIGHT / 2) + int(height / 2) + 1 - 180))
-                if game.achievements.cannons_reached:
-                    # draw shadow KILL CANNONS text
-                    text = game.big_font.render('Eliminate at least {} cannons'.format(game.achievements.cannons_goal), False, (0, 0, 0))
-                    screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 1 + 80, int(SCREEN_HEIGHT / 2) + int(height / 2) + 1 - 170))
-
-                    # draw normal KILL CANNONS text
-                    text = game.big_font.render('Eliminate at least {} cannons'.format(game.achievements.cannons_goal), False, (255, 255, 255))
-                    screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 80, int(SCREEN_HEIGHT / 2) + int(height / 2) - 170))
-
-                    # draw shadow KILL CANNONS text
-                    text = game.small_font.render('Unlocked! Cannons eliminated so far: {}'.format(game.achievements.cannons_killed), False, (0, 0, 0))
-                    screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 1 + 80, int(SCREEN_HEIGHT / 2) + int(height / 2) + 1 - 145))
-
-                    # draw normal KILL CANNONS text
-                    text = game.small_font.render('Unlocked! Cannons eliminated so far: {}'.format(game.achievements.cannons_killed), False, (255, 255, 255))
-                    screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 80, int(SCREEN_HEIGHT / 2) + int(height / 2) - 145))
-                else:
-                    # draw shadow KILL CANNONS text
-                    text = game.big_font.render('Eliminate at least {} cannons'.format(game.achievements.cannons_goal), False, (255, 255, 255))
-                    screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 1 + 80, int(SCREEN_HEIGHT / 2) + int(height / 2) + 1 - 170))
-
-                    # draw normal KILL CANNONS text
-                    text = game.big_font.render('Eliminate at least {} cannons'.format(game.achievements.cannons_goal), False, (0, 0, 0))
-                    screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 80, int(SCREEN_HEIGHT / 2) + int(height / 2) - 170))
-
-                    # draw shadow KILL CANNONS text
-                    text = game.small_font.render('Target not reached', False, (255, 255, 255))
-                    screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 1 + 80, int(SCREEN_HEIGHT / 2) + int(height / 2) + 1 - 145))
-
-                    # draw normal KILL CANNONS text
-                    text = game.small_font.render('Target not reached', False, (0, 0, 0))
-                    screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 80, int(SCREEN_HEIGHT / 2) + int(height / 2) - 145))
-
-                screen.blit(world, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 1, int(SCREEN_HEIGHT / 2) + int(height / 2) + 1 - 80))
-                if game.achievements.distance_reached:
-                    # draw shadow KILL CANNONS text
-                    text = game.big_font.render('Travel {} miles'.format(game.achievements.distance_goal), False, (0, 0, 0))
-                    screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 1 + 80, int(SCREEN_HEIGHT / 2) + int(height / 2) + 1 - 70))
-
-                    # draw normal KILL CANNONS text
-                    text = game.big_font.render('Travel {} miles'.format(game.achievements.distance_goal), False, (255, 255, 255))
-                    screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 80, int(SCREEN_HEIGHT / 2) + int(height / 2) - 70))
-
-                    # draw shadow KILL CANNONS text
-                    text = game.small_font.render('Unlocked! Traveled miles so far: {}'.format(game.achievements.distance_traveled), False, (0, 0, 0))
-                    screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 1 + 80, int(SCREEN_HEIGHT / 2) + int(height / 2) + 1 - 45))
-
-                    # draw normal KILL CANNONS text
-                    text = game.small_font.render('Unlocked! Traveled miles so far: {}'.format(game.achievements.distance_traveled), False, (255, 255, 255))
-                    screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 80, int(SCREEN_HEIGHT / 2) + int(height / 2) - 45))
-                else:
-                    # draw shadow KILL CANNONS text
-                    text = game.big_font.render('Travel {} miles'.format(game.achievements.distance_goal), False, (255, 255, 255))
-                    screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 1 + 80, int(SCREEN_HEIGHT / 2) + int(height / 2) + 1 - 70))
-
-                    # draw normal KILL CANNONS text
-                    text = game.big_font.render('Travel {} miles'.format(game.achievements.distance_goal), False, (0, 0, 0))
-                    screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 80, int(SCREEN_HEIGHT / 2) + int(height / 2) - 70))
-
-                    # draw shadow KILL CANNONS text
-                    text = game.small_font.render('Target not reached', False, (255, 255, 255))
-                    screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 1 + 80, int(SCREEN_HEIGHT / 2) + int(height / 2) + 1 - 45))
-
-                    # draw normal KILL CANNONS text
-                    text = game.small_font.render('Target not reached', False, (0, 0, 0))
-                    screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 80, int(SCREEN_HEIGHT / 2) + int(height / 2) - 45))
-
-                screen.blit(medal, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 1, int(SCREEN_HEIGHT / 2) + int(height / 2) + 1 + 20))
-                if game.achievements.score_reached:
-                    # draw shadow REACH GOAL text
-                    text = game.big_font.render('Reach over {} score points'.format(game.achievements.score_goal), False, (0, 0, 0))
-                    screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 1 + 80, int(SCREEN_HEIGHT / 2) + int(height / 2) + 1 + 30))
-
-                    # draw normal REACH GOAL text
-                    text = game.big_font.render('Reach over {} score points'.format(game.achievements.score_goal), False, (255, 255, 255))
-                    screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 80, int(SCREEN_HEIGHT / 2) + int(height / 2) + 30))
-
-                    # draw shadow UNLOCKED text
-                    text = game.small_font.render('Unlocked!', False, (0, 0, 0))
-                    screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 1 + 80, int(SCREEN_HEIGHT / 2) + int(height / 2) + 1 + 55))
-
-                    # draw normal UNLOCKED text
-                    text = game.small_font.render('Unlocked!', False, (255, 255, 255))
-                    screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 80, int(SCREEN_HEIGHT / 2) + int(height / 2) + 55))
-                else:
-                    # draw shadow REACH POINTS text
-                    text = game.big_font.render('Reach over {} score points'.format(game.achievements.score_goal), False, (255, 255, 255))
-                    screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 1 + 80, int(SCREEN_HEIGHT / 2) + int(height / 2) + 1 + 30))
-
-                    # draw normal REACH POINTS text
-                    text = game.big_font.render('Reach over {} score points'.format(game.achievements.score_goal), False, (0, 0, 0))
-                    screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 80, int(SCREEN_HEIGHT / 2) + int(height / 2) + 30))
-
-                    # draw shadow GOAL PENDING text
-                    text = game.small_font.render('Target not reached', False, (255, 255, 255))
-                    screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 1 + 80, int(SCREEN_HEIGHT / 2) + int(height / 2) + 1 + 55))
-
-                    # draw normal GOAL PENDING text
-                    text = game.small_font.render('Target not reached', False, (0, 0, 0))
-                    screen.blit(text, (int(SCREEN_WIDTH) / 2 - int(width / 2) + 80, int(SCREEN_HEIGHT / 2) + int(height / 2) + 55))
-
-
-
-        # render and limit fps to 50
-        pygame.display.flip()
+    # show the title right away while assets are loaded in the background
+    while not game.loader.ready():
+        display.canvas.fill((171, 227, 245))
+        draw_title(display.canvas, game, 'Loading... {}%'.format(game.loader.progress()))
+        display.present()
         game.tick()
 
-        # handle keypresses/gameplay
         for event in pygame.event.get():
             if event.type == pygame.locals.QUIT:
-                playing = False
-            elif event.type == pygame.locals.KEYDOWN:
-                if game.player.is_alive:
-                    if game.started:
-                        if game.screen == 'gameplay':
-                            if event.key == pygame.K_DOWN:
-                                game.player.down()
-                            elif event.key == pygame.K_UP:
-                                game.player.up()
-                            elif event.key == pygame.K_LEFT:
-                                game.player.left()
-                            elif event.key == pygame.K_RIGHT:
-                                game.player.right()
-                            elif event.key == pygame.K_SPACE:
-                                game.player.fire()
-                            elif event.key == pygame.K_a:
-                                game.screen = 'achievements'
-                        elif game.screen == 'achievements':
-                            if event.key == pygame.K_SPACE:
-                                game.screen = 'gameplay'
-                    else:
-                        if event.key == pygame.K_SPACE:
-                            game.started = True
+                sys.exit()
+            elif event.type == pygame.locals.VIDEORESIZE:
+                display.resize(event.size)
+    trace.mark('loading')
+    game.finish_loading()
+    if args.watch_level:
+        game.watcher = LevelWatcher(game, args.level)
+
+    # load screen configuration
+    camera = Camera(game.level.width * TILE_WIDTH - SCREEN_WIDTH, game.level.height * TILE_HEIGHT - SCREEN_HEIGHT)
 
+    trace.mark('spawn')
+    trace.report()
+
+    latency = profiling.LatencyTrace(enabled=args.trace_input)
+    blits = profiling.BlitTrace(enabled=args.trace_blits)
+    if args.trace_blits:
+        game.render_queue.trace = blits
+    game.stress_particles = args.stress_particles
+    memory = profiling.MemoryTrace(enabled=args.trace_memory)
+
+    # soak test samples about 100 times during the run, entity counts and
+    # timings may grow a bit by chance before they are reported
+    soak = profiling.SoakTrace(min(60, max(1, (args.soak or 0) * 60 / 100)), enabled=args.soak is not None,
+                               floors={'frame ms': 1, 'worst frame ms': 10, 'rss MB': 2, 'clock drift ms': 100,
+                                       'timers': 5, 'bullets': 2, 'particles': 50})
+    stepped = 0
+    game.input = Input(args.low_latency, latency)
+    autoplay = Autoplay(game) if args.autoplay else None
+    frames = 0
+    if args.threaded:
+        # world is updated on its own thread, this one only draws
+        simulation = Simulation(game)
+        game.framerate = 0
+        simulation.start()
+        while True:
+            keys = game.input.poll()
+            if game.input.quit:
+                break
+            if game.input.resized:
+                display.resize(game.input.resized)
+                game.input.resized = None
+            if autoplay is not None:
+                keys = keys + autoplay.keys()
+            simulation.send(keys, game.input.take())
+            simulation.check()
+
+            snapshot = simulation.latest()
+            if snapshot is not None:
+                draw_frame(display.canvas, game, snapshot, camera)
+                display.present()
+                game.input.presented(snapshot.presses)
+
+            # wait for the next snapshot, key presses are collected meanwhile
+            game.input.wait(game.frame_deadline(), (SNAPSHOT_READY,))
+            game.tick()
+
+            frames += 1
+            if frames == args.frames:
+                break
+        simulation.stop()
+    else:
+        if args.low_latency:
+            game.framerate = 0
+        pacer = FramePacer(game, args.adaptive, fixed=args.low_latency)
+        memory.start()
+        while True:
+            frame_start = time.perf_counter()
+
+            # handle keypresses first so this frame already shows the reaction
+            keys = game.input.poll()
+            if autoplay is not None:
+                keys = keys + autoplay.keys()
+            for key in keys:
+                game.press(key)
+            if game.input.quit:
+                break
+            if game.input.resized:
+                display.resize(game.input.resized)
+                game.input.resized = None
+            memory.mark('input')
+
+            for elapsed in pacer.steps(game.clock_elapsed):
+                game.update(elapsed)
+                stepped += elapsed
+            memory.mark('update')
+            draw_frame(display.canvas, game, game.snapshot(), camera)
+            memory.mark('draw')
+            display.present()
+            game.input.presented(game.input.take())
+            memory.mark('present')
+            soak.frame(time.perf_counter() - frame_start)
+
+            # limit fps to 50, key presses are collected while waiting
+            game.input.wait(game.frame_deadline())
+            game.tick()
+            memory.mark('wait')
+            memory.frame()
+
+            if soak.due():
+                # game time should keep up with the clock
+                values = {
+                    'rss MB': profiling.rss() / 1024 / 1024,
+                    'clock drift ms': (time.perf_counter() - soak.start) * 1000 - stepped,
+                    'timers': len(game.scheduler.events)
+                }
+                for name in ('bullets', 'particles', 'cannons', 'ships', 'hearts', 'medals'):
+                    values[name] = len(getattr(game, name))
+                soak.sample(values)
+                if soak.last - soak.start >= args.soak * 60:
+                    break
+
+            frames += 1
+            if frames == args.frames:
+                break
+        memory.stop()
+        pacer.report()
+    latency.report()
+    blits.report(game.assets.kinds)
+    memory.report()
+    soak.report()
+    if args.soak_log:
+        soak.write_log(args.soak_log)
+
+    failed = False
+    if args.memory_budget is not None and memory.percentile(0.95) > args.memory_budget * 1024:
+        over = sum(1 for allocated in memory.totals if allocated > args.memory_budget * 1024)
+        sys.stderr.write('memory budget exceeded: 95%% of frames allocate up to %.1f kB, budget is %.1f kB'
+                         ' (%d of %d frames over it)\n'
+                         % (memory.percentile(0.95) / 1024, args.memory_budget, over, len(memory.totals)))
+        failed = True
+    if soak.enabled and soak.growing():
+        failed = True
+    if failed:
+        sys.exit(1)
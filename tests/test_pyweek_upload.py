@@ -0,0 +1,76 @@
+'''Retry of pyweek-upload.py against a local server which drops the first
+connection.
+'''
+import io
+import os
+import socket
+import threading
+import contextlib
+import http.server
+import importlib.util
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# script name has a dash, so it is loaded from its file
+spec = importlib.util.spec_from_file_location('pyweek_upload', os.path.join(ROOT, 'pyweek-upload.py'))
+pyweek_upload = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(pyweek_upload)
+
+
+class DroppingHandler(http.server.BaseHTTPRequestHandler):
+    # first request is dropped before the body is read, so the client sees
+    # the connection break; later ones are read in full and answered
+    def do_POST(self):
+        server = self.server
+        server.requests += 1
+        if server.requests == 1:
+            self.connection.shutdown(socket.SHUT_RDWR)
+            self.close_connection = True
+            return
+        server.bodies.append(self.rfile.read(int(self.headers['Content-length'])))
+        self.send_response(200, 'OK')
+        self.send_header('Content-length', '8')
+        self.end_headers()
+        self.wfile.write(b'uploaded')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RetryTest(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.HTTPServer(('127.0.0.1', 0), DroppingHandler)
+        self.server.requests = 0
+        self.server.bodies = []
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+        handle, self.filename = tempfile.mkstemp(suffix='.zip')
+        with os.fdopen(handle, 'wb') as f:
+            f.write(os.urandom(pyweek_upload.CHUNK_SIZE * 2 + 100))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.remove(self.filename)
+
+    def test_whole_body_is_sent_again_after_broken_connection(self):
+        data = dict(version=2, user='user', description='test',
+                    content_file=pyweek_upload.Upload(self.filename))
+        with contextlib.redirect_stdout(io.StringIO()):
+            (status, reason, response) = pyweek_upload.http_request(
+                data, '127.0.0.1', self.server.server_address[1], '/e/test/oup/')
+
+        self.assertEqual((status, reason, response), (200, 'OK', b'uploaded'))
+        self.assertEqual(self.server.requests, 2)
+
+        expected = b''.join(pyweek_upload.mimeEncode(data).chunks())
+        self.assertEqual(self.server.bodies, [expected])
+        with open(self.filename, 'rb') as f:
+            self.assertIn(f.read(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()